@@ -0,0 +1,93 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Bulk resolution of package dependencies"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+# comparison operators of "name op evr" as returned by str() of a
+# versioned hawkey.Reldep
+RELDEP_OPS = frozenset(('<', '<=', '=', '>=', '>'))
+
+
+def split_reldep(reldep):
+    """Split the string form of a reldep into (name, op, evr).
+
+    op and evr are None for unversioned deps.
+    """
+    # names may contain spaces, evrs don't; this runs for every provide, so
+    # it avoids a regular expression
+    parts = reldep.rsplit(' ', 2)
+    if len(parts) != 3 or parts[1] not in RELDEP_OPS or not parts[0] or not parts[2]:
+        return reldep, None, None
+    return tuple(parts)
+
+
+class ProvidesIndex(object):
+    """Index of the provides of all packages in a query.
+
+    Plain name requirements, which are the vast majority, are answered
+    straight from the index. Versioned, rich and file requirements fall back
+    to a hawkey query, versioned ones only if some package provides the name
+    at all. The index is built on the first lookup.
+
+    If arches, the architectures of the sack as returned by
+    sack.list_arches(), are given, packages of other architectures which are
+    not installed provide nothing, like in libsolv.
+    """
+
+    def __init__(self, query, arches=None):
+        if arches is not None:
+            query = query.filter(arch=list(arches) + ['noarch']).union(query.installed())
+        self.query = query
+        self._providers = None
+
+    def _build(self):
+        self._providers = {}
+        for pkg in self.query:
+            for provide in pkg.provides:
+                name = split_reldep(str(provide))[0]
+                pkgs = self._providers.setdefault(name, [])
+                # a package often provides its name both with and without version
+                if not pkgs or pkgs[-1] != pkg:
+                    pkgs.append(pkg)
+
+    def providers(self, req):
+        """Return the list of packages providing req."""
+        reqname = str(req)
+        if reqname.startswith('(') or reqname.startswith('/'):
+            # rich deps and files from filelists are left to libsolv
+            return self.query.filter(provides=req).run()
+        if self._providers is None:
+            self._build()
+        name, op, _evr = split_reldep(reqname)
+        providers = self._providers.get(name, [])
+        if op is None or not providers:
+            return providers
+        return self.query.filter(provides=req).run()
+
+    def candidates(self, req):
+        """Return (package, provide) pairs providing the name of req in any
+        version, e.g. to explain why a versioned requirement is unresolved."""
+        reqname = str(req)
+        if reqname.startswith('(') or reqname.startswith('/'):
+            return []
+        if self._providers is None:
+            self._build()
+        name = split_reldep(reqname)[0]
+        return [(pkg, str(provide)) for pkg in self._providers.get(name, [])
+                for provide in pkg.provides if split_reldep(str(provide))[0] == name]
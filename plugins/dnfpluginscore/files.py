@@ -0,0 +1,100 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Atomic writes and caches persisted between runs"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from dnfpluginscore import _, logger
+
+import contextlib
+import json
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w', perms=0o644):
+    """
+    Open a temporary file next to path for writing, which replaces path when
+    the block finishes. If the block or the replacement fails, the temporary
+    file is removed again and the exception propagates.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    (fd, tmpfilename) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as out:
+            yield out
+        os.chmod(tmpfilename, perms)
+        os.rename(tmpfilename, path)
+    except BaseException:
+        try:
+            os.unlink(tmpfilename)
+        except OSError:
+            pass
+        raise
+
+
+def write_json(path, data):
+    """Atomically replace path with data in JSON."""
+    with atomic_write(path) as out:
+        json.dump(data, out)
+
+
+class JsonCache(object):
+    """
+    Entries persisted between runs in a JSON file.
+
+    The file also holds the values returned by _header(), all of which have
+    to match for the entries to be loaded. Only entries used or set during a
+    run are saved, so stale ones drop out.
+    """
+
+    # used in log messages
+    description = 'cache'
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.seen = {}
+        self._load()
+
+    def _header(self):
+        return {}
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                data = json.load(fp)
+        except (EnvironmentError, ValueError) as e:
+            logger.debug("Couldn't read %s %s: %s", self.description, self.path, e)
+            return
+        if not isinstance(data, dict) or not isinstance(data.get('entries'), dict) or \
+                any(data.get(key) != value for key, value in self._header().items()):
+            logger.debug("Discarding outdated %s %s", self.description, self.path)
+            return
+        self.entries = data['entries']
+
+    def save(self):
+        data = self._header()
+        data['entries'] = self.seen
+        try:
+            write_json(self.path, data)
+        except EnvironmentError as e:
+            logger.warning(_("Failed to write %s %s: %s"), self.description, self.path, e)
@@ -0,0 +1,198 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+""" Compact package dependency graphs"""
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from dnfpluginscore import logger
+from dnfpluginscore.files import atomic_write
+
+import array
+import json
+import sys
+
+
+class CSRGraph(object):
+    """Directed graph on nodes 0..n-1 in compressed sparse row form.
+
+    The targets of the edges leaving node i are
+    targets[offsets[i]:offsets[i + 1]], both are array('i').
+    """
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_lists(cls, adjacency):
+        offsets = array.array('i', [0])
+        targets = array.array('i')
+        for edges in adjacency:
+            targets.extend(edges)
+            offsets.append(len(targets))
+        return cls(offsets, targets)
+
+    @classmethod
+    def fromfile(cls, f, nodes, edges):
+        """Read a graph with the given number of nodes and edges written by
+        tofile() from the binary file object f."""
+        offsets = array.array('i')
+        targets = array.array('i')
+        offsets.fromfile(f, nodes + 1)
+        targets.fromfile(f, edges)
+        return cls(offsets, targets)
+
+    def tofile(self, f):
+        """Write the offsets and targets arrays to the binary file object f."""
+        self.offsets.tofile(f)
+        self.targets.tofile(f)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, node):
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def reverse(self):
+        """Return the graph with all edges reversed."""
+        n = len(self)
+        offsets = array.array('i', [0]) * (n + 1)
+        for v in self.targets:
+            offsets[v + 1] += 1
+        for i in range(n):
+            offsets[i + 1] += offsets[i]
+        fill = offsets[:-1]
+        targets = array.array('i', [0]) * len(self.targets)
+        for u in range(n):
+            for i in range(self.offsets[u], self.offsets[u + 1]):
+                v = self.targets[i]
+                targets[fill[v]] = u
+                fill[v] += 1
+        return CSRGraph(offsets, targets)
+
+
+def kosaraju(graph, rgraph):
+    """
+    Run Kosaraju's algorithm to find strongly connected components in the
+    graph, and return the components without any incoming edges as lists of
+    nodes. rgraph must be graph.reverse().
+    """
+    n = len(graph)
+    offsets, targets = graph.offsets, graph.targets
+    roffsets, rtargets = rgraph.offsets, rgraph.targets
+    rstack = array.array('i')
+    stack = array.array('i')
+    idx = array.array('i')
+    tag = bytearray(n)
+
+    # do depth-first searches in the graph and push nodes to rstack
+    # "on the way up" until all nodes have been pushed. idx holds the
+    # position of the next edge to follow of each node on the stack.
+    for u in range(n):
+        if tag[u]:
+            continue
+
+        stack.append(u)
+        idx.append(offsets[u + 1])
+        tag[u] = 1
+        while stack:
+            u = stack[-1]
+            i = idx[-1]
+
+            if i > offsets[u]:
+                i -= 1
+                idx[-1] = i
+                v = targets[i]
+                if not tag[v]:
+                    stack.append(v)
+                    idx.append(offsets[v + 1])
+                    tag[v] = 1
+            else:
+                stack.pop()
+                idx.pop()
+                rstack.append(u)
+
+    # now searches beginning at nodes popped from rstack in the graph with
+    # all edges reversed give us the strongly connected components. such a
+    # search only reaches nodes of the same component or of components found
+    # before, so an edge to an already visited node of another component is
+    # an incoming edge of the component. this time remove the tags as we
+    # visit each node.
+    component = array.array('i', [-1]) * n
+    leaves = []
+    count = 0
+    while rstack:
+        v = rstack.pop()
+        if not tag[v]:
+            continue
+
+        scc = [v]
+        incoming = False
+        stack.append(v)
+        tag[v] = 0
+        component[v] = count
+        while stack:
+            v = stack.pop()
+            for i in range(roffsets[v], roffsets[v + 1]):
+                u = rtargets[i]
+                if tag[u]:
+                    stack.append(u)
+                    tag[u] = 0
+                    component[u] = count
+                    scc.append(u)
+                elif component[u] != count:
+                    incoming = True
+
+        if not incoming:
+            leaves.append(scc)
+        count += 1
+
+    return leaves
+
+
+def load_graph(path, cookie):
+    """Return (node names, CSRGraph) stored by save_graph() if the cookie
+    matches, None otherwise."""
+    try:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf-8'))
+            if header.get('cookie') != cookie or header.get('byteorder') != sys.byteorder:
+                return None
+            graph = CSRGraph.fromfile(f, len(header['nodes']), header['edges'])
+    except (IOError, OSError, EOFError, ValueError, KeyError, AttributeError) as e:
+        logger.debug("Couldn't read graph cache %s: %s", path, e)
+        return None
+    return header['nodes'], graph
+
+
+def save_graph(path, cookie, nodes, graph):
+    """Store the graph as a JSON header with the cookie and the names of the
+    nodes followed by the offsets and targets int arrays."""
+    header = {
+        'cookie': cookie,
+        'byteorder': sys.byteorder,
+        'nodes': [str(node) for node in nodes],
+        'edges': len(graph.targets),
+    }
+    try:
+        with atomic_write(path, 'wb') as out:
+            out.write(json.dumps(header).encode('utf-8'))
+            out.write(b'\n')
+            graph.tofile(out)
+    except (IOError, OSError) as e:
+        logger.debug("Couldn't write graph cache %s: %s", path, e)
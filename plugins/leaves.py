@@ -15,7 +15,15 @@
 import dnf
 import dnf.sack
 import dnf.cli
+import itertools
+import os
 from dnfpluginscore import _
+from dnfpluginscore.deps import ProvidesIndex, split_reldep
+from dnfpluginscore.graph import CSRGraph, load_graph, save_graph
+import dnfpluginscore.graph
+
+# File in the dnf cachedir with the dependency graph of the installed packages
+GRAPH_CACHE_FILE = 'leaves-graph'
 
 
 class Leaves(dnf.Plugin):
@@ -35,118 +43,125 @@ class LeavesCommand(dnf.cli.Command):
         """
         Load the list of installed packages and their dependencies using
         hawkey, and build the dependency graph and the graph of reverse
-        dependencies.
+        dependencies as CSRGraphs.
+
+        The dependency graph is cached in the dnf cachedir and reused as
+        long as the rpmdb does not change.
         """
         query = dnf.sack._rpmdb_sack(self.base).query().apply()
+        cache_path = os.path.join(self.base.conf.cachedir, GRAPH_CACHE_FILE)
+        cookie = self.base._ts.dbCookie()
+        cached = load_graph(cache_path, cookie)
+        if cached is not None:
+            nevras, depends = cached
+            pkgmap = {str(pkg): pkg for pkg in query}
+            if len(pkgmap) == len(nevras) and all(n in pkgmap for n in nevras):
+                packages = [pkgmap[n] for n in nevras]
+                return (packages, depends, depends.reverse())
+
+        provides = ProvidesIndex(query)
         pkgmap = dict()
         packages = []
-        depends = []
-        rdepends = []
-        deps = set()
-        providers = set()
 
         for i, pkg in enumerate(query):
             pkgmap[pkg] = i
             packages.append(pkg)
-            rdepends.append([])
 
+        def providers_of(req):
+            return set(pkgmap[dpkg] for dpkg in provides.providers(req))
+
+        depends = CSRGraph.from_lists(
+            self._deps(i, pkg, providers_of) for i, pkg in enumerate(packages))
+        save_graph(cache_path, cookie, packages, depends)
+        return (packages, depends, depends.reverse())
+
+    def updategraph(self, graph, install_set, remove_set):
+        """
+        Return the graph returned by buildgraph() as it will be after a
+        transaction installing install_set and removing remove_set.
+
+        Only newly installed packages, packages with rich requirements and
+        packages requiring something that is provided by an installed or
+        removed package have their dependencies looked up again, all other
+        edges are kept.
+        """
+        (packages, depends, _rdepends) = graph
+        removed = set(str(pkg) for pkg in remove_set)
+        # names and files whose providers change
+        affected = set()
+        for pkg in itertools.chain(install_set, remove_set):
+            affected.update(split_reldep(str(provide))[0] for provide in pkg.provides)
+            affected.update(pkg.files)
+
+        newidx = {}
+        new_packages = []
+        for i, pkg in enumerate(packages):
+            if str(pkg) not in removed:
+                newidx[i] = len(new_packages)
+                new_packages.append(pkg)
+        first_installed = len(new_packages)
+        new_packages.extend(install_set)
+        pkgmap = dict((str(pkg), i) for i, pkg in enumerate(new_packages))
+
+        sack = self.base.sack
+        query = sack.query().installed().difference(
+            sack.query().filterm(pkg=list(remove_set))).union(
+            sack.query().filterm(pkg=list(install_set)))
+
+        provides = ProvidesIndex(query)
+
+        def providers_of(req):
+            return set(pkgmap[str(dpkg)] for dpkg in provides.providers(req)
+                       if str(dpkg) in pkgmap)
+
+        def is_affected(req):
+            # the providers of rich deps can't be told from their names
+            sreq = str(req)
+            return sreq.startswith('(') or split_reldep(sreq)[0] in affected
+
+        new_depends = []
         for i, pkg in enumerate(packages):
-            for req in pkg.requires:
-                sreq = str(req)
-                if sreq.startswith('rpmlib(') or sreq == 'solvable:prereqmarker':
-                    continue
-                for dpkg in query.filter(provides=req):
-                    providers.add(pkgmap[dpkg])
-                if len(providers) == 1 and i not in providers:
-                    deps.update(providers)
-                providers.clear()
-
-            deplist = list(deps)
-            deps.clear()
-            depends.append(deplist)
-            for j in deplist:
-                rdepends[j].append(i)
-
-        return (packages, depends, rdepends)
+            if i not in newidx:
+                continue
+            if any(j not in newidx for j in depends[i]) or \
+                    any(is_affected(req) for req in pkg.requires):
+                new_depends.append(self._deps(newidx[i], pkg, providers_of))
+            else:
+                new_depends.append([newidx[j] for j in depends[i]])
+        for i in range(first_installed, len(new_packages)):
+            new_depends.append(self._deps(i, new_packages[i], providers_of))
+
+        new_depends = CSRGraph.from_lists(new_depends)
+        return (new_packages, new_depends, new_depends.reverse())
+
+    @staticmethod
+    def _deps(i, pkg, providers_of):
+        """
+        Return the list of packages the package with index i depends on,
+        which are those being the only provider of one of its requirements.
+        """
+        deps = set()
+        for req in pkg.requires:
+            sreq = str(req)
+            if sreq.startswith('rpmlib(') or sreq == 'solvable:prereqmarker':
+                continue
+            providers = providers_of(req)
+            if len(providers) == 1 and i not in providers:
+                deps.update(providers)
+        return list(deps)
 
     def kosaraju(self, graph, rgraph):
         """
         Run Kosaraju's algorithm to find strongly connected components
         in the graph, and return the components without any incoming edges.
         """
-        N = len(graph)
-        rstack = []
-        stack = []
-        idx = []
-        tag = [False] * N
-
-        # do depth-first searches in the graph
-        # and push nodes to rstack "on the way up"
-        # until all nodes have been pushed.
-        # tag nodes so we don't visit them more than once
-        for u in range(N):
-            if tag[u]:
-                continue
-
-            stack.append(u)
-            idx.append(len(graph[u]))
-            tag[u] = True
-            while stack:
-                u = stack[-1]
-                i = idx[-1]
-
-                if i:
-                    i -= 1
-                    idx[-1] = i
-                    v = graph[u][i]
-                    if not tag[v]:
-                        stack.append(v)
-                        idx.append(len(graph[v]))
-                        tag[v] = True
-                else:
-                    stack.pop()
-                    idx.pop()
-                    rstack.append(u)
-
-        # now searches beginning at nodes popped from
-        # rstack in the graph with all edges reversed
-        # will give us the strongly connected components.
-        # the incoming edges to each component is the
-        # union of incoming edges to each node in the
-        # component minus the incoming edges from
-        # component nodes themselves.
-        # now all nodes are tagged, so this time let's
-        # remove the tags as we visit each node.
-        leaves = []
-        scc = []
-        sccredges = set()
-        while rstack:
-            v = rstack.pop()
-            if not tag[v]:
-                continue
+        if not isinstance(graph, CSRGraph):
+            graph = CSRGraph.from_lists(graph)
+            rgraph = graph.reverse()
+        return dnfpluginscore.graph.kosaraju(graph, rgraph)
 
-            stack.append(v)
-            tag[v] = False
-            while stack:
-                v = stack.pop()
-                redges = rgraph[v]
-                scc.append(v)
-                sccredges.update(redges)
-                for u in redges:
-                    if tag[u]:
-                        stack.append(u)
-                        tag[u] = False
-
-            sccredges.difference_update(scc)
-            if not sccredges:
-                leaves.append(scc.copy())
-            del scc[:]
-            sccredges.clear()
-
-        return leaves
-
-    def findleaves(self):
-        (packages, depends, rdepends) = self.buildgraph()
+    def findleaves(self, graph=None):
+        (packages, depends, rdepends) = graph or self.buildgraph()
         return [packages[i] for scc in self.kosaraju(depends, rdepends) for i in scc]
 
     def run(self):
@@ -26,13 +26,17 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 from dnfpluginscore import logger, _
+from dnfpluginscore.files import JsonCache, atomic_write
 
 import dnf
 import dnf.cli
+import dnf.rpm.transaction
 import dbus
 import functools
+import json
 import os
 import re
+import rpm
 import stat
 import sys
 import time
@@ -44,6 +48,9 @@ NEED_REBOOT = ['kernel', 'kernel-core', 'kernel-rt', 'glibc',
                'linux-firmware', 'systemd', 'dbus', 'dbus-broker',
                'dbus-daemon', 'microcode_ctl']
 
+# File in the dnf cachedir keeping per-process results between runs
+CACHE_FILE = 'needs-restarting.json'
+
 def get_options_from_dir(filepath, base):
     """
     Provide filepath as string if single dir or list of strings
@@ -61,9 +68,7 @@ def get_options_from_dir(filepath, base):
             for line in fp:
                 options.add((line.rstrip(), file))
 
-    packages = set()
-    for pkg in base.sack.query().installed().filter(name={x[0] for x in options}):
-        packages.add(pkg.name)
+    packages = installed_package_names(base, {x[0] for x in options})
     for name, file in {x for x in options if x[0] not in packages}:
         logger.warning(
             _('No installed package found for package name "{pkg}" '
@@ -71,21 +76,58 @@ def get_options_from_dir(filepath, base):
     return packages
 
 
+def installed_package_names(base, names):
+    """Return the subset of names which are installed.
+
+    Works without an activated sack by looking the names up in the rpmdb.
+    """
+    if base.sack is None:
+        ts = dnf.rpm.transaction.initReadOnlyTransaction(root=base.conf.installroot)
+        return {name for name in names if ts.dbMatch('name', name).count()}
+    return {pkg.name for pkg in base.sack.query().installed().filter(name=list(names))}
+
+
+def updated_since(base, provides, since):
+    """Return names of installed packages providing any of provides that
+    were installed after since.
+
+    Reads the rpmdb headers directly, so neither the sack nor any repository
+    metadata has to be loaded.
+    """
+    ts = dnf.rpm.transaction.initReadOnlyTransaction(root=base.conf.installroot)
+    names = set()
+    for provide in set(provides):
+        for hdr in ts.dbMatch('providename', provide):
+            if hdr[rpm.RPMTAG_INSTALLTIME] > since:
+                names.add(dnf.i18n.ucd(hdr[rpm.RPMTAG_NAME]))
+    return names
+
+
 def list_opened_files(uid):
     for (pid, smaps) in list_smaps():
         try:
             if uid is not None and uid != owner_uid(smaps):
                 continue
-            with open(smaps, 'r', errors='replace') as smaps_file:
-                lines = smaps_file.readlines()
         except EnvironmentError:
             logger.warning("Failed to read PID %d's smaps.", pid)
             continue
 
-        for line in lines:
-            ofile = smap2opened_file(pid, line)
-            if ofile is not None:
-                yield ofile
+        for ofile in read_opened_files(pid, smaps):
+            yield ofile
+
+
+def read_opened_files(pid, smaps):
+    try:
+        with open(smaps, 'r', errors='replace') as smaps_file:
+            lines = smaps_file.readlines()
+    except EnvironmentError:
+        logger.warning("Failed to read PID %d's smaps.", pid)
+        return
+
+    for line in lines:
+        ofile = smap2opened_file(pid, line)
+        if ofile is not None:
+            yield ofile
 
 
 def list_smaps():
@@ -122,12 +164,15 @@ def owning_package(sack, fname):
     return None
 
 
-def print_cmd(pid):
+def get_cmdline(pid):
     cmdline = '/proc/%d/cmdline' % pid
     with open(cmdline) as cmdline_file:
         command = dnf.i18n.ucd(cmdline_file.read())
-    command = ' '.join(command.split('\000'))
-    print('%d : %s' % (pid, command))
+    return ' '.join(command.split('\000'))
+
+
+def print_cmd(pid):
+    print('%d : %s' % (pid, get_cmdline(pid)))
 
 
 def get_service_dbus(pid):
@@ -209,6 +254,52 @@ class OpenedFile(object):
                 return match.group(1)
         return self.name
 
+class ProcessCache(JsonCache):
+    """Results of the smaps scan of each process, persisted between runs.
+
+    Entries are keyed by PID together with the process start time, so a
+    recycled PID is never mistaken for the process scanned previously. The
+    whole cache is dropped once the rpmdb cookie changes, because package
+    install times are the only other input of the scan.
+    """
+
+    description = 'needs-restarting cache'
+
+    def __init__(self, path, cookie):
+        self.cookie = cookie
+        super(ProcessCache, self).__init__(path)
+
+    def _header(self):
+        return {'cookie': self.cookie}
+
+    def get(self, pid, start):
+        """Return {file: owning package} of the stale files used by the
+        process, or None if the process was not scanned yet."""
+        entry = self.entries.get(str(pid))
+        if not isinstance(entry, dict) or entry.get('start') != start:
+            return None
+        self.seen[str(pid)] = entry
+        return entry['files']
+
+    def set(self, pid, start, files):
+        self.seen[str(pid)] = {'start': start, 'files': files}
+
+
+def print_json(data):
+    print(json.dumps(data, indent=4, sort_keys=True))
+
+
+def write_metrics(path, metrics):
+    """Atomically write (name, help, value) metrics to path in the
+    Prometheus text exposition format used by node_exporter's textfile
+    collector."""
+    with atomic_write(path) as out:
+        for name, help_, value in metrics:
+            out.write('# HELP %s %s\n' % (name, help_))
+            out.write('# TYPE %s gauge\n' % name)
+            out.write('%s %d\n' % (name, value))
+
+
 class ProcessStart(object):
     def __init__(self):
         self.kernel_boot_time = ProcessStart.get_kernel_boot_time()
@@ -332,8 +423,18 @@ class NeedsRestartingCommand(dnf.cli.Command):
                             help=_("only report affected systemd services"))
         parser.add_argument('--exclude-services', action='store_true',
                             help=_("don't list stale processes that correspond to a systemd service"))
+        parser.add_argument('--incremental', action='store_true',
+                            help=_("reuse results of the previous run for processes "
+                                   "that were already scanned"))
+        parser.add_argument('--prometheus', metavar='FILE',
+                            help=_("also write the results as Prometheus metrics to FILE"))
+        parser.add_argument('--json', action='store_true',
+                            help=_("print the results with per-process details in JSON format"))
 
     def configure(self):
+        if self.opts.reboothint:
+            # --reboothint reads installed packages straight from the rpmdb
+            return
         demands = self.cli.demands
         demands.sack_activation = True
         self.base.conf.optional_metadata_types += ["filelists"]
@@ -349,12 +450,15 @@ class NeedsRestartingCommand(dnf.cli.Command):
             self.base)
         NEED_REBOOT.extend(opt)
         if self.opts.reboothint:
-            need_reboot = set()
-            installed = self.base.sack.query().installed()
-            for pkg in installed.filter(provides=NEED_REBOOT):
-                if pkg.installtime > process_start.boot_time:
-                    need_reboot.add(pkg.name)
-            if need_reboot:
+            need_reboot = updated_since(self.base, NEED_REBOOT, process_start.boot_time)
+            if self.opts.prometheus:
+                self._write_metrics([('dnf_needs_restarting_reboot_required',
+                                      'Whether core libraries or services have been '
+                                      'updated since boot-up.',
+                                      bool(need_reboot))])
+            if self.opts.json:
+                print_json(self._reboot_report(process_start, need_reboot))
+            elif need_reboot:
                 print(_('Core libraries or services have been updated '
                         'since boot-up:'))
                 for name in sorted(need_reboot):
@@ -363,29 +467,40 @@ class NeedsRestartingCommand(dnf.cli.Command):
                 print(_('Reboot is required to fully utilize these updates.'))
                 print(_('More information:'),
                       'https://access.redhat.com/solutions/27943')
-                raise dnf.exceptions.Error()  # Sets exit code 1
             else:
                 print(_('No core libraries or services have been updated '
                         'since boot-up.'))
                 print(_('Reboot should not be necessary.'))
-                return None
+            if need_reboot:
+                raise dnf.exceptions.Error()  # Sets exit code 1
+            return None
 
         stale_pids = set()
         stale_services = {}
+        units = {}
         uid = os.geteuid() if self.opts.useronly else None
-        for ofile in list_opened_files(uid):
-            pkg = owning_pkg_fn(ofile.presumed_name)
-            pid = ofile.pid
-            if pkg is None:
-                continue
-            if pkg.installtime <= process_start(pid):
-                continue
-            if self.opts.services or self.opts.exclude_services:
-                result = get_service_dbus(pid)
+        cache = None
+        if self.opts.incremental:
+            cache = ProcessCache(os.path.join(self.base.conf.cachedir, CACHE_FILE),
+                                 self.base._ts.dbCookie())
+        stale_files = self._stale_files(process_start, owning_pkg_fn, uid, cache)
+        if cache is not None:
+            cache.save()
+        for pid in stale_files:
+            if self.opts.services or self.opts.exclude_services or self.opts.json:
+                try:
+                    result = get_service_dbus(pid)
+                except dbus.DBusException as e:
+                    # the unit is only informative in the JSON report
+                    if self.opts.services or self.opts.exclude_services:
+                        raise
+                    logger.debug("Failed to get systemd unit for PID %d: %s", pid, e)
+                    result = None
                 if result is None:
                     stale_pids.add(pid)
                 else:
                     service_name, fragment_path = result
+                    units[pid] = service_name
                     stale_services[service_name] = fragment_path
                     if not self.opts.exclude_services:
                         stale_pids.add(pid)
@@ -394,18 +509,29 @@ class NeedsRestartingCommand(dnf.cli.Command):
                 # query D-Bus at all.
                 stale_pids.add(pid)
 
+        if self.opts.prometheus:
+            metrics = [('dnf_needs_restarting_stale_processes',
+                        'Number of processes using files updated since they started.',
+                        len(stale_pids))]
+            if self.opts.services or self.opts.exclude_services:
+                metrics.append(('dnf_needs_restarting_stale_services',
+                                'Number of systemd services using files updated since they started.',
+                                len(stale_services)))
+            self._write_metrics(metrics)
+
+        if self.opts.json:
+            need_reboot = updated_since(self.base, NEED_REBOOT, process_start.boot_time)
+            reboot_service_names = self._reboot_services(stale_services, owning_pkg_fn)
+            report = self._reboot_report(process_start, need_reboot)
+            report['processes'] = [self._process_report(pid, units.get(pid), *stale_files[pid])
+                                   for pid in sorted(stale_pids)]
+            report['services'] = sorted(set(stale_services) - reboot_service_names)
+            report['reboot_services'] = sorted(reboot_service_names)
+            print_json(report)
+            return 0
+
         if self.opts.services:
-            installed_need_reboot_pkgs = set()
-            for pkg in self.base.sack.query().installed().filterm(
-                    provides=NEED_REBOOT):
-                installed_need_reboot_pkgs.add(pkg.name)
-            reboot_service_names = set()
-            for svc, fragment_path in stale_services.items():
-                if fragment_path:
-                    unit_pkg = owning_pkg_fn(fragment_path)
-                    if unit_pkg and \
-                            unit_pkg.name in installed_need_reboot_pkgs:
-                        reboot_service_names.add(svc)
+            reboot_service_names = self._reboot_services(stale_services, owning_pkg_fn)
             for svc in sorted(set(stale_services) - reboot_service_names):
                 print(svc)
             if reboot_service_names:
@@ -418,3 +544,75 @@ class NeedsRestartingCommand(dnf.cli.Command):
 
         for pid in sorted(stale_pids):
             print_cmd(pid)
+
+    def _reboot_services(self, stale_services, owning_pkg_fn):
+        """Return names of the stale services which belong to packages
+        requiring a reboot rather than a restart."""
+        installed_need_reboot_pkgs = set()
+        for pkg in self.base.sack.query().installed().filterm(
+                provides=NEED_REBOOT):
+            installed_need_reboot_pkgs.add(pkg.name)
+        reboot_service_names = set()
+        for svc, fragment_path in stale_services.items():
+            if fragment_path:
+                unit_pkg = owning_pkg_fn(fragment_path)
+                if unit_pkg and \
+                        unit_pkg.name in installed_need_reboot_pkgs:
+                    reboot_service_names.add(svc)
+        return reboot_service_names
+
+    @staticmethod
+    def _reboot_report(process_start, need_reboot):
+        return {
+            'boot_time': process_start.boot_time,
+            'reboot_required': bool(need_reboot),
+            # packages updated since boot-up which are the reason for the reboot
+            'reboot_packages': sorted(need_reboot),
+        }
+
+    @staticmethod
+    def _process_report(pid, unit, start, files):
+        try:
+            cmdline = get_cmdline(pid)
+        except EnvironmentError:
+            cmdline = None
+        return {
+            'pid': pid,
+            'start_time': start,
+            'cmdline': cmdline,
+            'unit': unit,
+            'files': [{'file': fname, 'package': files[fname]} for fname in sorted(files)],
+        }
+
+    def _stale_files(self, process_start, owning_pkg_fn, uid, cache):
+        """Map the PIDs of processes using files from packages installed
+        after the process started to (start time, {file: owning package})."""
+        stale_files = {}
+        for (pid, smaps) in list_smaps():
+            try:
+                if uid is not None and uid != owner_uid(smaps):
+                    continue
+                start = process_start(pid)
+            except EnvironmentError:
+                # the process is already gone
+                continue
+            files = cache.get(pid, start) if cache is not None else None
+            if files is None:
+                files = {}
+                for ofile in read_opened_files(pid, smaps):
+                    pkg = owning_pkg_fn(ofile.presumed_name)
+                    if pkg is None or pkg.installtime <= start:
+                        continue
+                    files[ofile.presumed_name] = str(pkg)
+                if cache is not None:
+                    cache.set(pid, start, files)
+            if files:
+                stale_files[pid] = (start, files)
+        return stale_files
+
+    def _write_metrics(self, metrics):
+        try:
+            write_metrics(self.opts.prometheus, metrics)
+        except EnvironmentError as e:
+            raise dnf.exceptions.Error(_("Failed to write metrics to {}: {}").format(
+                self.opts.prometheus, e))
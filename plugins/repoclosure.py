@@ -21,9 +21,124 @@
 
 from __future__ import absolute_import
 from __future__ import unicode_literals
-from dnfpluginscore import _
+from dnfpluginscore import _, logger
+from dnfpluginscore.deps import ProvidesIndex, split_reldep
+from dnfpluginscore.files import write_json
 
+import array
+import concurrent.futures
 import dnf.cli
+import dnf.rpm
+import hashlib
+import hawkey
+import json
+import multiprocessing
+import time
+
+# command whose sack the forked per-arch workers inherit
+_worker_command = None
+
+
+def _closure_worker(arch):
+    try:
+        return _worker_command._arch_closure(arch), None
+    except dnf.exceptions.Error as e:
+        # dnf exceptions don't survive pickling back to the parent
+        return None, str(e)
+
+
+class Baseline(object):
+    """Resolved dependencies of a previous run, see --baseline.
+
+    Packages are identified by repo and NEVRA. For every dependency the
+    indices of its providers in the list of packages available in that run
+    are kept, an empty list marks an unresolved dependency. The report of
+    the run is reused as it is if the metadata checksums and the set of
+    available packages did not change.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path, checksums, options):
+        self.path = path
+        self.checksums = checksums
+        self.options = options
+        self.packages = []
+        self.deps = {}
+        self.report = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            logger.debug("Couldn't read repoclosure baseline %s: %s", self.path, e)
+            return
+        if not isinstance(data, dict) or not isinstance(data.get('packages'), list) or \
+                not isinstance(data.get('deps'), dict):
+            logger.debug("Discarding invalid repoclosure baseline %s", self.path)
+            return
+        if data.get('version') != self.VERSION or data.get('options') != self.options:
+            logger.debug("Repoclosure baseline %s was created with other options", self.path)
+            return
+        self.packages = data['packages']
+        self.deps = data['deps']
+        if self.checksums is not None and data.get('checksums') == self.checksums and \
+                isinstance(data.get('report'), list):
+            self.report = data['report']
+
+    def save(self, report):
+        data = {
+            'version': self.VERSION,
+            'checksums': self.checksums,
+            'options': self.options,
+            'packages': self.packages,
+            'deps': self.deps,
+            'report': report,
+        }
+        try:
+            write_json(self.path, data)
+        except (IOError, OSError) as e:
+            raise dnf.exceptions.Error(
+                _("Failed to write repoclosure baseline {}: {}").format(self.path, e))
+
+    def resolve(self, deps, provides):
+        """Return a {dep: resolved} map of the dep strings.
+
+        Only dependencies which are new, lost all their providers or were
+        unresolved but some newly added package provides their name are
+        resolved again. The baseline is updated to the current state.
+        """
+        packages = [pkg_key(pkg) for pkg in provides.query]
+        index = {key: i for i, key in enumerate(packages)}
+        old_to_new = [index.get(key) for key in self.packages]
+        old_keys = set(self.packages)
+        added_names = set()
+        for pkg in provides.query:
+            if pkg_key(pkg) not in old_keys:
+                added_names.update(split_reldep(str(provide))[0] for provide in pkg.provides)
+
+        resolved = {}
+        for dep in deps:
+            old = self.deps.get(dep)
+            if old:
+                providers = [old_to_new[i] for i in old if old_to_new[i] is not None]
+                if providers:
+                    resolved[dep] = providers
+                    continue
+            elif old is not None and not dep.startswith(('(', '/')) and \
+                    split_reldep(dep)[0] not in added_names:
+                resolved[dep] = []
+                continue
+            resolved[dep] = [index[pkg_key(pkg)] for pkg in provides.providers(dep)]
+        self.packages = packages
+        self.deps = resolved
+        return {dep: bool(providers) for dep, providers in resolved.items()}
+
+
+def pkg_key(pkg):
+    return "{}/{}".format(pkg.reponame, pkg)
 
 
 class RepoClosure(dnf.Plugin):
@@ -43,7 +158,8 @@ class RepoClosureCommand(dnf.cli.Command):
 
     def configure(self):
         demands = self.cli.demands
-        demands.sack_activation = True
+        # with --per-arch only the workers load the metadata of their arch
+        demands.sack_activation = not self.opts.per_arch
         demands.available_repos = True
         self.base.conf.optional_metadata_types += ["filelists"]
         if self.opts.repo:
@@ -52,30 +168,201 @@ class RepoClosureCommand(dnf.cli.Command):
                     repo.disable()
                 else:
                     repo.enable()
+        # the sack is loaded between configure() and run()
+        self._configured = time.time()
 
     def run(self):
+        self.baseline = None
+        self.timings = {"sack_load": time.time() - self._configured}
+        if self.opts.baseline:
+            if self.opts.per_arch:
+                raise dnf.exceptions.Error(_("--baseline cannot be combined with --per-arch"))
+            self.baseline = Baseline(self.opts.baseline, self._baseline_checksums(),
+                                     self._baseline_options())
+        if self.opts.per_arch:
+            reports = self._run_per_arch()
+        elif self.baseline is not None and self.baseline.report is not None:
+            logger.debug("Metadata did not change, using report from %s", self.opts.baseline)
+            reports = [(None, self.baseline.report, self.timings)]
+        else:
+            if self.opts.arches:
+                report = self._report(self._get_unresolved(self.opts.arches))
+            else:
+                report = self._report(self._get_unresolved())
+            if self.baseline is not None:
+                self.baseline.save(report)
+            reports = [(None, report, self.timings)]
         total_missing = 0
-        if self.opts.arches:
-            unresolved = self._get_unresolved(self.opts.arches)
+        total_packages = 0
+        for arch, report, timings in reports:
+            for phase in sorted(timings):
+                logger.debug("repoclosure %s%s: %.3f s", phase,
+                             " ({})".format(arch) if arch else "", timings[phase])
+            for pkg, reponame, deps in report:
+                total_missing += len(deps)
+            total_packages += len(report)
+        if self.opts.format == "json":
+            self._print_json(reports, total_missing, total_packages)
         else:
-            unresolved = self._get_unresolved()
-        for pkg in sorted(unresolved.keys()):
-            print("package: {} from {}".format(str(pkg), pkg.reponame))
-            print("  unresolved deps ({}):".format(len(unresolved[pkg])))
-            total_missing += len(unresolved[pkg])
-            for dep in unresolved[pkg]:
-                print("    {}".format(dep))
-        if len(unresolved) > 0:
+            self._print_text(reports)
+        if total_packages > 0:
             msg = _(
                 "Repoclosure ended with unresolved dependencies ({}) across {} packages.".format(
-                    total_missing, len(unresolved)
+                    total_missing, total_packages
                 )
             )
             raise dnf.exceptions.Error(msg)
 
+    @staticmethod
+    def _print_text(reports):
+        for arch, report, _timings in reports:
+            if arch is not None:
+                print("arch: {}".format(arch))
+            for pkg, reponame, deps in report:
+                print("package: {} from {}".format(pkg, reponame))
+                print("  unresolved deps ({}):".format(len(deps)))
+                for dep, _candidates in deps:
+                    print("    {}".format(dep))
+
+    @staticmethod
+    def _print_json(reports, total_missing, total_packages):
+        data = {
+            "unresolved_deps": total_missing,
+            "packages": total_packages,
+            "reports": [],
+        }
+        for arch, report, timings in reports:
+            data["reports"].append({
+                "arch": arch,
+                "timings": timings,
+                "packages": [{
+                    "package": pkg,
+                    "repo": reponame,
+                    "unresolved": [{
+                        "dep": dep,
+                        "candidates": [{"package": cpkg, "repo": crepo, "provides": provide}
+                                       for cpkg, crepo, provide in candidates],
+                    } for dep, candidates in deps],
+                } for pkg, reponame, deps in report],
+            })
+        print(json.dumps(data, indent=4, sort_keys=True))
+
+    def _report(self, unresolved):
+        """Turn the result of _get_unresolved() into a list of
+        (package, repo, [(dep, candidates)]) with just strings.
+
+        The candidates are (package, repo, provide) of packages providing the
+        name of the dep in a version which does not satisfy it. They are only
+        shown in JSON output and stored in the baseline, otherwise they are
+        left empty.
+        """
+        with_candidates = self.opts.format == "json" or self.baseline is not None
+        candidates = {}
+        report = []
+        for pkg in sorted(unresolved.keys()):
+            deps = []
+            for dep in unresolved[pkg]:
+                dep = str(dep)
+                if not with_candidates:
+                    deps.append((dep, []))
+                    continue
+                if dep not in candidates:
+                    candidates[dep] = [(str(cpkg), cpkg.reponame, provide)
+                                       for cpkg, provide in self._provides.candidates(dep)]
+                deps.append((dep, candidates[dep]))
+            report.append((str(pkg), pkg.reponame, deps))
+        return report
+
+    def _baseline_checksums(self):
+        if self.base.sack.query().filter(reponame=hawkey.CMDLINE_REPO_NAME):
+            # local packages are not covered by any repo metadata
+            return None
+        checksums = {}
+        for repo in self.base.repos.iter_enabled():
+            checksum = hashlib.sha256()
+            for mdtype in ("primary", "filelists"):
+                path = repo.get_metadata_path(mdtype)
+                if not path:
+                    continue
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        checksum.update(chunk)
+            checksums[repo.id] = checksum.hexdigest()
+        # excludes, --setopt and module or other configuration changes alter
+        # the available packages without touching the metadata
+        checksum = hashlib.sha256()
+        for key in sorted(pkg_key(pkg) for pkg in self.base.sack.query().available()):
+            checksum.update(key.encode('utf-8'))
+            checksum.update(b'\n')
+        checksums['@available'] = checksum.hexdigest()
+        return checksums
+
+    def _baseline_options(self):
+        return [sorted(self.opts.arches), sorted(self.opts.check), self.opts.newest,
+                sorted(self.opts.pkglist), self.base.conf.best]
+
+    def _run_per_arch(self):
+        """Check the closure of each --arch in a separate worker process.
+
+        No sack is loaded by the parent. Each forked worker reads the
+        repositories again for its architecture and loads their metadata into
+        a sack of that architecture.
+        """
+        global _worker_command
+        arches = [arch for arch in self.opts.arches if arch != 'noarch']
+        if not arches:
+            raise dnf.exceptions.Error(_("--per-arch requires at least one --arch"))
+        _worker_command = self
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(arches),
+                                                    mp_context=context) as executor:
+            results = list(executor.map(_closure_worker, arches))
+        reports = []
+        for arch, (result, error) in zip(arches, results):
+            if error is not None:
+                raise dnf.exceptions.Error(_("Checking {} failed: {}").format(arch, error))
+            reports.append((arch,) + result)
+        return reports
+
+    def _arch_closure(self, arch):
+        start = time.time()
+        self._read_arch_repos(arch)
+        self.base.fill_sack(load_system_repo=False)
+        self.timings = {"sack_load": time.time() - start}
+        # noarch packages are checked against every architecture
+        check_arches = [arch] + [a for a in self.opts.arches if a == 'noarch']
+        return self._report(self._get_unresolved(check_arches)), self.timings
+
+    def _read_arch_repos(self, arch):
+        """Read the repositories again with $arch and $basearch substituted
+        for arch, keeping the enabled state of the current ones.
+
+        The URLs of the current repositories were substituted for the host
+        architecture when they were read, using them would load the host
+        metadata again. Repositories which are not in the configuration,
+        like those of --repofrompath, are kept as they are.
+        """
+        previous = list(self.base.repos.values())
+        enabled = set(repo.id for repo in self.base.repos.iter_enabled())
+        self.base.reset(sack=True, repos=True)
+        self.base.conf.substitutions['arch'] = arch
+        self.base.conf.substitutions['basearch'] = dnf.rpm.basearch(arch)
+        self.base.read_all_repos(self.opts)
+        for repo in previous:
+            if repo.id not in self.base.repos:
+                self.base.repos.add(repo)
+        for repo in self.base.repos.values():
+            if repo.id in enabled:
+                repo.enable()
+            else:
+                repo.disable()
+
     def _get_unresolved(self, arch=None):
-        unresolved = {}
-        deps = set()
+        # Requirements are interned: every distinct dep string gets an id (its
+        # index in deps) and each package only keeps a compact array of ids.
+        dep_ids = {}
+        deps = []
+        requires = []
 
         # We have two sets of packages, available and to_check:
         # * available is the set of packages used to satisfy dependencies
@@ -97,19 +384,17 @@ class RepoClosureCommand(dnf.cli.Command):
         # to_check  | all     | all                 | latest per repo | latest per repo     |
 
         if self.opts.newest:
-            available = self.base.sack.query().filter(empty=True)
-            to_check = self.base.sack.query().filter(empty=True)
+            latest = []
             for repo in self.base.repos.iter_enabled():
-                available = \
-                    available.union(self.base.sack.query().filter(reponame=repo.id).latest())
-                to_check = \
-                    to_check.union(self.base.sack.query().filter(reponame=repo.id).latest())
+                latest.extend(self.base.sack.query().filter(reponame=repo.id).latest())
+            available = self.base.sack.query().filterm(pkg=latest)
+            to_check = self.base.sack.query().filterm(pkg=latest)
         else:
             available = self.base.sack.query().available()
             to_check = self.base.sack.query().available()
 
         if self.opts.pkglist:
-            pkglist_q = self.base.sack.query().filter(empty=True)
+            pkglist = []
             errors = []
             for pkg in self.opts.pkglist:
                 subj = dnf.subject.Subject(pkg)
@@ -117,13 +402,13 @@ class RepoClosureCommand(dnf.cli.Command):
                     subj.get_best_query(self.base.sack, with_nevra=True,
                                         with_provides=False, with_filenames=False))
                 if pkg_q:
-                    pkglist_q = pkglist_q.union(pkg_q)
+                    pkglist.extend(pkg_q)
                 else:
                     errors.append(pkg)
             if errors:
                 raise dnf.exceptions.Error(
                     _('no package matched: %s') % ', '.join(errors))
-            to_check = pkglist_q
+            to_check = self.base.sack.query().filterm(pkg=pkglist)
 
         if self.opts.check:
             to_check.filterm(reponame=self.opts.check)
@@ -137,28 +422,57 @@ class RepoClosureCommand(dnf.cli.Command):
         available.apply()
         to_check.apply()
 
+        start = time.time()
         for pkg in to_check:
-            unresolved[pkg] = set()
+            ids = array.array('i')
             for req in pkg.requires:
                 reqname = str(req)
                 # XXX: https://bugzilla.redhat.com/show_bug.cgi?id=1186721
                 if reqname.startswith("solvable:") or \
                         reqname.startswith("rpmlib("):
                     continue
-                deps.add(req)
-                unresolved[pkg].add(req)
+                dep_id = dep_ids.get(reqname)
+                if dep_id is None:
+                    dep_id = dep_ids[reqname] = len(deps)
+                    deps.append(reqname)
+                ids.append(dep_id)
+            if ids:
+                requires.append((pkg, ids))
+        dep_ids = None
+        self.timings["requires_collection"] = time.time() - start
 
-        unresolved_deps = set(x for x in deps if not available.filter(provides=x))
+        start = time.time()
+        provides = ProvidesIndex(available, self.base.sack.list_arches())
+        if self.baseline is not None:
+            resolved = self.baseline.resolve(deps, provides)
+            unresolved_deps = bytearray(not resolved[dep] for dep in deps)
+        else:
+            unresolved_deps = bytearray(not provides.providers(dep) for dep in deps)
+        self.timings["resolution"] = time.time() - start
+        self._provides = provides
 
-        unresolved_transition = {k: set(x for x in v if x in unresolved_deps)
-                                 for k, v in unresolved.items()}
-        return {k: v for k, v in unresolved_transition.items() if v}
+        # only packages with unresolved deps are materialized
+        unresolved = {}
+        for pkg, ids in requires:
+            missing = set(deps[i] for i in ids if unresolved_deps[i])
+            if missing:
+                unresolved[pkg] = missing
+        return unresolved
 
     @staticmethod
     def set_argparser(parser):
         parser.add_argument("--arch", default=[], action="append", dest='arches',
                             help=_("check packages of the given archs, can be "
                                    "specified multiple times"))
+        parser.add_argument("--per-arch", action="store_true",
+                            help=_("check the closure of each --arch separately and "
+                                   "in parallel"))
+        parser.add_argument("--baseline", metavar="FILE",
+                            help=_("reuse dependencies resolved by the previous run "
+                                   "stored in FILE and update it"))
+        parser.add_argument("--format", choices=("text", "json"), default="text",
+                            help=_("output format, json includes candidate providers "
+                                   "and timings"))
         parser.add_argument("--check", default=[], action="append",
                             help=_("Specify repositories to check"))
         parser.add_argument("-n", "--newest", action="store_true",
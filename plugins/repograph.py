@@ -22,8 +22,15 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from dnfpluginscore import _, logger
+from dnfpluginscore.deps import ProvidesIndex
+from dnfpluginscore.graph import CSRGraph
+from xml.sax.saxutils import quoteattr
 
+import collections
 import dnf.cli
+import dnf.exceptions
+import json
+import sys
 
 DOT_HEADER = """
 size="20.69,25.52";
@@ -33,6 +40,23 @@ orientation=port;
 node[style="filled"];
 """
 
+# number of output lines collected before writing them out
+WRITE_BATCH = 5000
+
+
+def write_lines(lines):
+    """Write lines to stdout in batches of WRITE_BATCH."""
+    write = sys.stdout.write
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == WRITE_BATCH:
+            batch.append("")
+            write("\n".join(batch))
+            batch = []
+    batch.append("")
+    write("\n".join(batch))
+
 
 class RepoGraph(dnf.Plugin):
 
@@ -49,6 +73,19 @@ class RepoGraphCommand(dnf.cli.Command):
     aliases = ("repograph", "repo-graph",)
     summary = _("Output a full package dependency graph in dot format")
 
+    @staticmethod
+    def set_argparser(parser):
+        parser.add_argument("--format", choices=("dot", "csv", "graphml", "csr"),
+                            default="dot",
+                            help=_("output format: dot, an edge list in csv, graphml "
+                                   "or binary compressed sparse row arrays"))
+        parser.add_argument("--subgraph", metavar="PKG",
+                            help=_("output only package PKG and the packages it "
+                                   "requires"))
+        parser.add_argument("--depth", type=int, default=1, metavar="N",
+                            help=_("follow the requirements of --subgraph up to N "
+                                   "levels deep (default 1)"))
+
     def configure(self):
         demands = self.cli.demands
         demands.sack_activation = True
@@ -61,38 +98,133 @@ class RepoGraphCommand(dnf.cli.Command):
                     repo.enable()
 
     def run(self):
-        self.do_dot(DOT_HEADER)
-
-    def do_dot(self, header):
-        maxdeps = 0
+        if self.opts.depth < 1:
+            raise dnf.exceptions.Error(_("--depth must be at least 1"))
         deps = self._get_deps(self.base.sack)
+        if self.opts.subgraph:
+            if not self.base.sack.query().available().filter(name=self.opts.subgraph):
+                raise dnf.exceptions.Error(
+                    _("No package named '{}' available").format(self.opts.subgraph))
+            deps = self._subgraph(deps, self.opts.subgraph, self.opts.depth)
+
+        if self.opts.format == "csv":
+            write_lines(self._csv_lines(deps))
+        elif self.opts.format == "graphml":
+            write_lines(self._graphml_lines(deps))
+        elif self.opts.format == "csr":
+            self.do_csr(deps)
+        else:
+            self.do_dot(DOT_HEADER, deps)
+
+    def do_dot(self, header, deps=None):
+        if deps is None:
+            deps = self._get_deps(self.base.sack)
+        write_lines(self._dot_lines(header, deps))
 
-        print("digraph packages {")
-        print("{}".format(header))
+    @staticmethod
+    def _dot_lines(header, deps):
+        yield "digraph packages {"
+        yield "{}".format(header)
 
         for pkg in deps.keys():
-            if len(deps[pkg]) > maxdeps:
-                maxdeps = len(deps[pkg])
-
             # color calculations lifted from rpmgraph
             h = 0.5 + (0.6 / 23 * len(deps[pkg]))
             s = h + 0.1
             b = 1.0
 
-            print('"{}" [color="{:.12g} {:.12g} {}"];'.format(pkg, h, s, b))
-            print('"{}" -> {{'.format(pkg))
+            yield '"{}" [color="{:.12g} {:.12g} {}"];'.format(pkg, h, s, b)
+            yield '"{}" -> {{'.format(pkg)
+            for req in deps[pkg]:
+                yield '"{}"'.format(req)
+            yield '}} [color="{:.12g} {:.12g} {}"];\n'.format(h, s, b)
+        yield "}"
+
+    @staticmethod
+    def _csv_lines(deps):
+        # package names never contain commas or quotes
+        yield "source,target"
+        for pkg in deps.keys():
+            for req in deps[pkg]:
+                yield "{},{}".format(pkg, req)
+
+    def _graphml_lines(self, deps):
+        nodes, graph = self._csr(deps)
+        yield '<?xml version="1.0" encoding="UTF-8"?>'
+        yield '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">'
+        yield '<graph id="packages" edgedefault="directed">'
+        ids = [quoteattr(node) for node in nodes]
+        for node in ids:
+            yield '<node id={}/>'.format(node)
+        for i, node in enumerate(ids):
+            for j in graph[i]:
+                yield '<edge source={} target={}/>'.format(node, ids[j])
+        yield '</graph>'
+        yield '</graphml>'
+
+    def do_csr(self, deps):
+        """
+        Write a JSON header line with the node names followed by the offsets
+        and targets int arrays of the graph in native byte order.
+        """
+        if sys.stdout.isatty():
+            raise dnf.exceptions.Error(
+                _("Refusing to write binary graph to a terminal, redirect the output"))
+        nodes, graph = self._csr(deps)
+        header = {
+            'byteorder': sys.byteorder,
+            'itemsize': graph.targets.itemsize,
+            'nodes': nodes,
+            'edges': len(graph.targets),
+        }
+        sys.stdout.flush()
+        out = getattr(sys.stdout, 'buffer', sys.stdout)
+        out.write(json.dumps(header).encode('utf-8'))
+        out.write(b'\n')
+        graph.tofile(out)
+        out.flush()
+
+    @staticmethod
+    def _csr(deps):
+        """Return the list of node names and the CSRGraph of deps."""
+        nodes = list(deps.keys())
+        index = dict((name, i) for i, name in enumerate(nodes))
+        for reqs in deps.values():
+            for req in reqs:
+                if req not in index:
+                    index[req] = len(nodes)
+                    nodes.append(req)
+        adjacency = [[index[req] for req in deps[pkg]] for pkg in deps.keys()]
+        adjacency.extend([] for _i in range(len(nodes) - len(adjacency)))
+        return nodes, CSRGraph.from_lists(adjacency)
+
+    @staticmethod
+    def _subgraph(deps, root, depth):
+        """
+        Return the part of deps with the packages root requires directly or
+        indirectly, up to depth levels deep, found by a breadth-first search.
+        """
+        subgraph = {}
+        seen = set([root])
+        queue = collections.deque([(root, 0)])
+        while queue:
+            pkg, level = queue.popleft()
+            if level >= depth or pkg not in deps:
+                continue
+            subgraph[pkg] = deps[pkg]
             for req in deps[pkg]:
-                print('"{}"'.format(req))
-            print('}} [color="{:.12g} {:.12g} {}"];\n'.format(h, s, b))
-        print("}")
+                if req not in seen:
+                    seen.add(req)
+                    queue.append((req, level + 1))
+        return subgraph
 
     @staticmethod
     def _get_deps(sack):
         requires = {}
         prov = {}
-        skip = []
+        skip = set()
 
         available = sack.query().available()
+        provides = ProvidesIndex(available, sack.list_arches())
         for pkg in available:
             xx = {}
             for req in pkg.requires:
@@ -105,10 +237,10 @@ class RepoGraphCommand(dnf.cli.Command):
                 if reqname in prov:
                     provider = prov[reqname]
                 else:
-                    provider = available.filter(provides=reqname)
+                    provider = provides.providers(req)
                     if not provider:
                         logger.debug(_("Nothing provides: '%s'"), reqname)
-                        skip.append(reqname)
+                        skip.add(reqname)
                         continue
                     else:
                         provider = provider[0].name
@@ -21,12 +21,149 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from dnfpluginscore import _, logger
+from dnfpluginscore.files import JsonCache
 
+import bz2
+import concurrent.futures
 import dnf
 import dnf.cli
+import dnf.cli.format
+import dnf.rpm.transaction
+import errno
+import functools
+import gzip
+import hashlib
+import json
 import logging
+import lzma
+import multiprocessing
 import os
 import hawkey
+import rpm
+import shutil
+import subprocess
+import xml.etree.ElementTree as ET
+
+# Directory in the dnf cachedir with the NEVRAs read from rpm headers
+HEADER_CACHE_DIR = 'repomanage-headers'
+
+# rpm transaction set used by _read_header() in the current process
+_header_ts = None
+
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+
+# openers of the compressed metadata formats supported without a sack
+METADATA_OPENERS = {
+    '.xml': open,
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+
+def read_repomd(filename):
+    """Return {type: location} of the metadata listed in repomd.xml."""
+    locations = {}
+    for data in ET.parse(filename).getroot().iter(REPO_NS + 'data'):
+        location = data.find(REPO_NS + 'location')
+        if location is not None:
+            locations[data.get('type')] = location.get('href')
+    return locations
+
+
+def iter_primary(filename):
+    """Yield (nevra, location) of the packages in primary.xml, which is
+    parsed as a stream to keep memory usage flat."""
+    opener = METADATA_OPENERS[os.path.splitext(filename)[1]]
+    with opener(filename, 'rb') as fp:
+        root = None
+        for event, elem in ET.iterparse(fp, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event != 'end' or elem.tag != COMMON_NS + 'package':
+                continue
+            version = elem.find(COMMON_NS + 'version')
+            nevra = (elem.findtext(COMMON_NS + 'name'), int(version.get('epoch') or 0),
+                     version.get('ver'), version.get('rel'), elem.findtext(COMMON_NS + 'arch'))
+            yield nevra, elem.find(COMMON_NS + 'location').get('href')
+            # drop the packages already parsed
+            root.clear()
+
+
+def read_nevra(ts, filename):
+    """Return (name, epoch, version, release, arch) read from the header of
+    the rpm file. Like in hawkey the arch of source packages is src or nosrc.
+    """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        hdr = ts.hdrFromFdno(fd)
+    finally:
+        os.close(fd)
+    arch = hdr[rpm.RPMTAG_ARCH]
+    if hdr[rpm.RPMTAG_SOURCEPACKAGE]:
+        arch = 'nosrc' if hdr[rpm.RPMTAG_NOSOURCE] or hdr[rpm.RPMTAG_NOPATCH] else 'src'
+    return (hdr[rpm.RPMTAG_NAME], hdr[rpm.RPMTAG_EPOCH] or 0,
+            hdr[rpm.RPMTAG_VERSION], hdr[rpm.RPMTAG_RELEASE], arch)
+
+
+def _read_header(filename):
+    """Return (nevra, None) read from the rpm file, or (None, error message)
+    if it can't be read. Runs in the --workers processes."""
+    global _header_ts
+    if _header_ts is None:
+        _header_ts = dnf.rpm.transaction.initReadOnlyTransaction()
+    try:
+        return read_nevra(_header_ts, filename), None
+    except (EnvironmentError, rpm.error) as e:
+        # rpm.error doesn't survive pickling back to the parent
+        return None, str(e)
+
+
+def sorted_stream_versions(module_dict):
+    """Return the module packages of every stream in module_dict grouped by
+    version, as a list per stream sorted from the oldest version."""
+    return [[streams_by_version[version] for version in sorted(streams_by_version.keys())]
+            for streams_by_version in module_dict.values()]
+
+
+def compare_nevra(a, b):
+    """Compare (name, epoch, version, release, arch) tuples the way hawkey
+    sorts packages, by name, then evr, then arch."""
+    return ((a[0] > b[0]) - (a[0] < b[0]) or
+            rpm.labelCompare((str(a[1]), a[2], a[3]), (str(b[1]), b[2], b[3])) or
+            (a[4] > b[4]) - (a[4] < b[4]))
+
+
+class HeaderCache(JsonCache):
+    """NEVRAs read from the headers of the rpm files in a directory,
+    persisted between runs.
+
+    Entries are keyed by the file path together with its size, mtime and
+    inode, so a file which is replaced or rewritten is read again.
+    """
+
+    VERSION = 2
+    description = 'repomanage header cache'
+
+    def _header(self):
+        return {'version': self.VERSION}
+
+    @staticmethod
+    def _key(st):
+        return [st.st_size, st.st_mtime, st.st_ino]
+
+    def get(self, filename, st):
+        """Return the NEVRA of the file, or None if it is not cached or the
+        file changed since."""
+        entry = self.entries.get(filename)
+        if not isinstance(entry, list) or entry[:3] != self._key(st):
+            return None
+        self.seen[filename] = entry
+        return tuple(entry[3:])
+
+    def set(self, filename, st, nevra):
+        self.seen[filename] = self._key(st) + list(nevra)
 
 
 class RepoManage(dnf.Plugin):
@@ -52,7 +189,26 @@ class RepoManageCommand(dnf.cli.Command):
         if not self.opts.verbose and not self.opts.quiet:
             self.cli.redirect_repo_progress()
         demands = self.cli.demands
-        demands.sack_activation = True
+        # without modular metadata the NEVRAs are all that is needed, so
+        # local primary.xml or rpm headers are read directly without a sack
+        self.primary = None
+        self.use_sack = False
+        repomd = os.path.join(self.opts.path, 'repodata', 'repomd.xml')
+        if '://' in self.opts.path:
+            self.use_sack = True
+        elif os.path.exists(repomd):
+            try:
+                metadata = read_repomd(repomd)
+            except (EnvironmentError, ET.ParseError) as e:
+                logger.debug("Couldn't read %s: %s", repomd, e)
+                metadata = {}
+            primary = metadata.get('primary')
+            if 'modules' in metadata or primary is None or \
+                    os.path.splitext(primary)[1] not in METADATA_OPENERS:
+                self.use_sack = True
+            else:
+                self.primary = os.path.join(self.opts.path, primary)
+        demands.sack_activation = self.use_sack
 
     def run(self):
         if self.opts.new and self.opts.old:
@@ -61,8 +217,16 @@ class RepoManageCommand(dnf.cli.Command):
             raise dnf.exceptions.Error(_("Pass either --oldonly or --new, not both!"))
         if self.opts.old and self.opts.oldonly:
             raise dnf.exceptions.Error(_("Pass either --old or --oldonly, not both!"))
+        if (self.opts.delete or self.opts.move) and not self.opts.old and not self.opts.oldonly:
+            raise dnf.exceptions.Error(_("--delete and --move require --old or --oldonly"))
+        if (self.opts.delete or self.opts.move) and "://" in self.opts.path:
+            raise dnf.exceptions.Error(_("--delete and --move require a local path"))
         if not self.opts.old and not self.opts.oldonly:
             self.opts.new = True
+        if self.opts.workers < 1:
+            raise dnf.exceptions.Error(_("--workers must be at least 1"))
+        if self.opts.delete and self.opts.move:
+            raise dnf.exceptions.Error(_("Pass either --delete or --move, not both!"))
 
         verfile = {}
         pkgdict = {}
@@ -71,151 +235,82 @@ class RepoManageCommand(dnf.cli.Command):
 
         keepnum = int(self.opts.keep) # the number of items to keep
 
-        try:
-            REPOMANAGE_REPOID = "repomanage_repo"
-            repo_conf = self.base.repos.add_new_repo(REPOMANAGE_REPOID, self.base.conf, baseurl=[self.opts.path])
-            # Always expire the repo, otherwise repomanage could use cached metadata and give identical results
-            # for multiple runs even if the actual repo changed in the meantime
-            repo_conf._repo.expire()
-            self.base._add_repo_to_sack(repo_conf)
-            if dnf.base.WITH_MODULES:
-                self.base._setup_modular_excludes()
-
-                # Prepare modules
-                module_packages = self.base._moduleContainer.getModulePackages()
-
-                for module_package in module_packages:
-                    # Even though we load only REPOMANAGE_REPOID other modules can be loaded from system
-                    # failsafe data automatically, we don't want them affecting repomanage results so ONLY
-                    # use modules from REPOMANAGE_REPOID.
-                    if module_package.getRepoID() == REPOMANAGE_REPOID:
-                        all_modular_artifacts.update(module_package.getArtifacts())
-                        module_dict.setdefault(module_package.getNameStream(), {}).setdefault(
-                            module_package.getVersionNum(), []).append(module_package)
-
-        except dnf.exceptions.RepoError:
-            rpm_list = []
-            rpm_list = self._get_file_list(self.opts.path, ".rpm")
-            if len(rpm_list) == 0:
-                raise dnf.exceptions.Error(_("No files to process"))
-
-            self.base.reset(sack=True, repos=True)
-            self.base.fill_sack(load_system_repo=False, load_available_repos=False)
-            try:
-                self.base.add_remote_rpms(rpm_list, progress=self.base.output.progress)
-            except IOError:
-                logger.warning(_("Could not open {}").format(', '.join(rpm_list)))
-
-        # Prepare regular packages
-        query = self.base.sack.query(flags=hawkey.IGNORE_MODULAR_EXCLUDES).available()
-        packages = [x for x in query.filter(pkg__neq=query.filter(nevra_strict=all_modular_artifacts)).available()]
-        packages.sort()
+        if self.primary is not None:
+            files = self._read_primary(self.primary)
+            query = None
+        elif not self.use_sack:
+            files = self._read_nevras(self._get_rpm_list())
+            query = None
+        else:
+            files, query = self._load_sack(module_dict, all_modular_artifacts)
 
-        for pkg in packages:
-            na = (pkg.name, pkg.arch)
+        for nevra, path in files:
+            na = (nevra[0], nevra[4])
             if na in pkgdict:
-                if pkg not in pkgdict[na]:
-                    pkgdict[na].append(pkg)
+                # the same NEVRA may exist as several files, verfile has them all
+                if nevra not in pkgdict[na]:
+                    pkgdict[na].append(nevra)
             else:
-                pkgdict[na] = [pkg]
+                pkgdict[na] = [nevra]
 
-            nevra = self._package_to_nevra(pkg)
             if nevra in verfile:
-                verfile[nevra].append(self._package_to_path(pkg))
+                verfile[nevra].append(path)
             else:
-                verfile[nevra] = [self._package_to_path(pkg)]
+                verfile[nevra] = [path]
 
         outputpackages = []
-        # modular packages
-        keepnum_latest_stream_artifacts = set()
-
-        if self.opts.new:
-            # regular packages
-            for (n, a) in pkgdict.keys():
-                evrlist = pkgdict[(n, a)]
-
-                newevrs = evrlist[-keepnum:]
-
-                for package in newevrs:
-                    nevra = self._package_to_nevra(package)
-                    for fpkg in verfile[nevra]:
-                        outputpackages.append(fpkg)
-
-            # modular packages
-            for streams_by_version in module_dict.values():
-                sorted_stream_versions = sorted(streams_by_version.keys())
-
-                new_sorted_stream_versions = sorted_stream_versions[-keepnum:]
-
-                for i in new_sorted_stream_versions:
-                    for stream in streams_by_version[i]:
-                        keepnum_latest_stream_artifacts.update(set(stream.getArtifacts()))
-
-        if self.opts.old:
-            # regular packages
-            for (n, a) in pkgdict.keys():
-                evrlist = pkgdict[(n, a)]
-
-                oldevrs = evrlist[:-keepnum]
-
-                for package in oldevrs:
-                    nevra = self._package_to_nevra(package)
-                    for fpkg in verfile[nevra]:
-                        outputpackages.append(fpkg)
-
-            # modular packages
-            for streams_by_version in module_dict.values():
-                sorted_stream_versions = sorted(streams_by_version.keys())
-
-                old_sorted_stream_versions = sorted_stream_versions[:-keepnum]
-
-                for i in old_sorted_stream_versions:
-                    for stream in streams_by_version[i]:
-                        keepnum_latest_stream_artifacts.update(set(stream.getArtifacts()))
-
-        if self.opts.oldonly:
-            # regular packages
-            for (n, a) in pkgdict.keys():
-                evrlist = pkgdict[(n, a)]
-
-                oldevrs = evrlist[:-keepnum]
-
-                for package in oldevrs:
-                    nevra = self._package_to_nevra(package)
-                    for fpkg in verfile[nevra]:
-                        outputpackages.append(fpkg)
-
-            # modular packages
-            keepnum_newer_stream_artifacts = set()
-
-            for streams_by_version in module_dict.values():
-                sorted_stream_versions = sorted(streams_by_version.keys())
-
-                new_sorted_stream_versions = sorted_stream_versions[-keepnum:]
-
-                for i in new_sorted_stream_versions:
-                    for stream in streams_by_version[i]:
-                        keepnum_newer_stream_artifacts.update(set(stream.getArtifacts()))
-
-            for streams_by_version in module_dict.values():
-                sorted_stream_versions = sorted(streams_by_version.keys())
-
-                old_sorted_stream_versions = sorted_stream_versions[:-keepnum]
+        # regular packages
+        for evrlist in pkgdict.values():
+            if self.opts.new:
+                selected = evrlist[-keepnum:]
+            else:
+                selected = evrlist[:-keepnum]
+            for nevra in selected:
+                outputpackages.extend(verfile[nevra])
 
-                for i in old_sorted_stream_versions:
-                    for stream in streams_by_version[i]:
-                        for artifact in stream.getArtifacts():
-                            if artifact not in keepnum_newer_stream_artifacts:
-                                keepnum_latest_stream_artifacts.add(artifact)
+        # modular packages
+        keepnum_latest_stream_artifacts = self._select_stream_artifacts(
+            sorted_stream_versions(module_dict), keepnum)
 
-        modular_packages = [self._package_to_path(x) for x in query.filter(pkg__eq=query.filter(nevra_strict=keepnum_latest_stream_artifacts)).available()]
-        outputpackages = outputpackages + modular_packages
+        if keepnum_latest_stream_artifacts:
+            modular_packages = [self._package_to_path(x) for x in query.filter(
+                nevra_strict=list(keepnum_latest_stream_artifacts))]
+            outputpackages = outputpackages + modular_packages
         outputpackages.sort()
-        if self.opts.space:
-            print(" ".join(outputpackages))
+        if not self.opts.delete and not self.opts.move and not self.opts.json:
+            if self.opts.space:
+                print(" ".join(outputpackages))
+            else:
+                for pkg in outputpackages:
+                    print(pkg)
+            return
+
+        action = "delete" if self.opts.delete else "move" if self.opts.move else None
+        (count, size, failed) = self._apply_action(action, outputpackages)
+        if self.opts.json:
+            print(json.dumps({
+                "action": action,
+                "dry_run": self.opts.dry_run,
+                "packages": outputpackages,
+                "count": count,
+                "bytes": size,
+                "failed": [{"path": path, "error": error} for path, error in failed],
+            }, indent=4, sort_keys=True))
         else:
-            for pkg in outputpackages:
-                print(pkg)
+            for path, error in failed:
+                logger.warning(_("Could not {} {}: {}").format(action, path, error))
+            if self.opts.dry_run:
+                msg = _("Would delete {} packages ({})") if action == "delete" else \
+                    _("Would move {} packages ({})")
+            else:
+                msg = _("Deleted {} packages ({})") if action == "delete" else \
+                    _("Moved {} packages ({})")
+            print(msg.format(count, dnf.cli.format.format_number(size).strip()))
+
+        if action and self.opts.createrepo and not self.opts.dry_run:
+            self._createrepo()
+        if action and failed:
+            raise dnf.exceptions.Error(_("Failed to {} {} packages").format(action, len(failed)))
 
     @staticmethod
     def set_argparser(parser):
@@ -230,6 +325,22 @@ class RepoManageCommand(dnf.cli.Command):
         parser.add_argument("-k", "--keep", action="store", metavar="KEEP",
                             help=_("Newest N packages to keep - defaults to 1"),
                             default=1, type=int)
+        parser.add_argument("--workers", action="store", metavar="N",
+                            help=_("Read rpm headers of directories without repodata "
+                                   "in N parallel processes - defaults to 1"),
+                            default=1, type=int)
+        parser.add_argument("--delete", action="store_true",
+                            help=_("Delete the selected packages"))
+        parser.add_argument("--move", action="store", metavar="DIR",
+                            help=_("Move the selected packages to directory DIR"))
+        parser.add_argument("--dry-run", action="store_true",
+                            help=_("Only report what --delete or --move would do"))
+        parser.add_argument("--json", action="store_true",
+                            help=_("Print a JSON summary of the selected packages and "
+                                   "their size"))
+        parser.add_argument("--createrepo", action="store_true",
+                            help=_("Update the repodata with createrepo_c after "
+                                   "--delete or --move"))
         parser.add_argument("path", action="store",
                             help=_("Path to directory"))
 
@@ -247,6 +358,207 @@ class RepoManageCommand(dnf.cli.Command):
 
         return filelist
 
+    def _load_sack(self, module_dict, all_modular_artifacts):
+        """Load the repository in path into the sack, fill module_dict and
+        all_modular_artifacts with its modules and return (nevra, path) of
+        its packages together with the query of all of them.
+        """
+        try:
+            REPOMANAGE_REPOID = "repomanage_repo"
+            repo_conf = self.base.repos.add_new_repo(REPOMANAGE_REPOID, self.base.conf, baseurl=[self.opts.path])
+            # Always expire the repo, otherwise repomanage could use cached metadata and give identical results
+            # for multiple runs even if the actual repo changed in the meantime
+            repo_conf._repo.expire()
+            self.base._add_repo_to_sack(repo_conf)
+            if dnf.base.WITH_MODULES:
+                self.base._setup_modular_excludes()
+
+                # Prepare modules
+                module_packages = self.base._moduleContainer.getModulePackages()
+
+                for module_package in module_packages:
+                    # Even though we load only REPOMANAGE_REPOID other modules can be loaded from system
+                    # failsafe data automatically, we don't want them affecting repomanage results so ONLY
+                    # use modules from REPOMANAGE_REPOID.
+                    if module_package.getRepoID() == REPOMANAGE_REPOID:
+                        all_modular_artifacts.update(module_package.getArtifacts())
+                        module_dict.setdefault(module_package.getNameStream(), {}).setdefault(
+                            module_package.getVersionNum(), []).append(module_package)
+
+        except dnf.exceptions.RepoError:
+            return self._read_nevras(self._get_rpm_list()), None
+        else:
+            # Prepare regular packages
+            query = self.base.sack.query(flags=hawkey.IGNORE_MODULAR_EXCLUDES).available()
+            packages = [x for x in query.filter(pkg__neq=query.filter(nevra_strict=all_modular_artifacts)).available()]
+            packages.sort()
+            files = [(self._package_to_nevra(pkg), self._package_to_path(pkg)) for pkg in packages]
+            return files, query
+
+    def _select_stream_artifacts(self, streams, keepnum):
+        """Return the artifacts of the newest keepnum versions of all streams
+        with --new, of the older versions with --old, and of the older
+        versions except those also in the newest ones with --oldonly."""
+        newer = set()
+        older = set()
+        for versions in streams:
+            # the newest and older versions don't overlap, so the artifacts
+            # of each module are fetched at most once
+            if not self.opts.old:
+                for modules in versions[-keepnum:]:
+                    for module in modules:
+                        newer.update(module.getArtifacts())
+            if not self.opts.new:
+                for modules in versions[:-keepnum]:
+                    for module in modules:
+                        older.update(module.getArtifacts())
+        if self.opts.new:
+            return newer
+        if self.opts.oldonly:
+            older.difference_update(newer)
+        return older
+
+    def _apply_action(self, action, paths):
+        """
+        Delete or move the files, or only stat them with --dry-run or without
+        action. The files are handled directory by directory, with the
+        directory opened only once. Return (number of files, their total size,
+        [(path, error)] of failures).
+
+        Moving a file fails if the target directory already contains a file of
+        the same name, or if another selected file of that name is moved too.
+        """
+        count = 0
+        size = 0
+        failed = []
+        moved = set()
+        by_dir = {}
+        for path in paths:
+            by_dir.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+
+        modify = action is not None and not self.opts.dry_run
+        if action == "move" and modify and not os.path.isdir(self.opts.move):
+            os.makedirs(self.opts.move)
+        for dirname in sorted(by_dir):
+            try:
+                dir_fd = os.open(dirname or os.curdir, os.O_RDONLY)
+            except EnvironmentError as e:
+                # the directory vanished since it was listed
+                failed.extend((os.path.join(dirname, name), e.strerror or str(e))
+                              for name in by_dir[dirname])
+                continue
+            try:
+                for name in by_dir[dirname]:
+                    try:
+                        st = os.stat(name, dir_fd=dir_fd)
+                        if action == "move":
+                            if name in moved or \
+                                    os.path.lexists(os.path.join(self.opts.move, name)):
+                                raise OSError(errno.EEXIST, os.strerror(errno.EEXIST))
+                            moved.add(name)
+                        if modify and action == "delete":
+                            os.unlink(name, dir_fd=dir_fd)
+                        elif modify:
+                            self._move(dirname, dir_fd, name)
+                    except EnvironmentError as e:
+                        failed.append((os.path.join(dirname, name), e.strerror or str(e)))
+                        continue
+                    count += 1
+                    size += st.st_size
+            finally:
+                os.close(dir_fd)
+        return count, size, failed
+
+    def _move(self, dirname, dir_fd, name):
+        try:
+            os.rename(name, os.path.join(os.path.abspath(self.opts.move), name),
+                      src_dir_fd=dir_fd)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # --move to another filesystem
+            shutil.move(os.path.join(dirname, name), os.path.join(self.opts.move, name))
+
+    def _createrepo(self):
+        args = ["createrepo_c", "--update"]
+        if not self.opts.verbose:
+            args.append("--quiet")
+        args.append(self.opts.path)
+        logger.debug(_("Updating repodata in {}").format(self.opts.path))
+        try:
+            p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except EnvironmentError as e:
+            raise dnf.exceptions.Error(_("Could not run createrepo_c: {}").format(e))
+        for line in p.stdout:
+            logger.info(line.decode().rstrip("\n"))
+        if p.wait() != 0:
+            raise dnf.exceptions.Error(
+                _("createrepo_c failed with exit code {}").format(p.returncode))
+
+    def _get_rpm_list(self):
+        rpm_list = self._get_file_list(self.opts.path, ".rpm")
+        if len(rpm_list) == 0:
+            raise dnf.exceptions.Error(_("No files to process"))
+        return rpm_list
+
+    def _read_primary(self, filename):
+        """Return (nevra, path) of the packages in primary.xml sorted like
+        hawkey packages."""
+        try:
+            files = [(nevra, os.path.join(self.opts.path, location))
+                     for nevra, location in iter_primary(filename)]
+        except (EnvironmentError, EOFError, lzma.LZMAError, ET.ParseError) as e:
+            raise dnf.exceptions.Error(_("Could not read {}: {}").format(filename, e))
+        nevra_key = functools.cmp_to_key(compare_nevra)
+        files.sort(key=lambda f: nevra_key(f[0]))
+        return files
+
+    def _read_nevras(self, rpm_list):
+        """Return (nevra, path) of the rpm files sorted like hawkey packages.
+
+        Only headers of files which are not in the header cache are read.
+        """
+        path = os.path.abspath(self.opts.path).encode('utf-8')
+        cache = HeaderCache(os.path.join(self.base.conf.cachedir, HEADER_CACHE_DIR,
+                                         hashlib.sha256(path).hexdigest() + '.json'))
+        files = []
+        missing = []
+        for filename in rpm_list:
+            try:
+                st = os.stat(filename)
+            except EnvironmentError as e:
+                logger.warning(_("Could not open {}: {}").format(filename, e))
+                continue
+            nevra = cache.get(filename, st)
+            if nevra is None:
+                missing.append((filename, st))
+            else:
+                files.append((nevra, filename))
+
+        results = self._read_headers([filename for filename, _st in missing])
+        for (filename, st), (nevra, error) in zip(missing, results):
+            if error is not None:
+                logger.warning(_("Could not open {}: {}").format(filename, error))
+                continue
+            cache.set(filename, st, nevra)
+            files.append((nevra, filename))
+        cache.save()
+        nevra_key = functools.cmp_to_key(compare_nevra)
+        files.sort(key=lambda f: nevra_key(f[0]))
+        return files
+
+    def _read_headers(self, filenames):
+        """Return the _read_header() results of the files, read in --workers
+        processes."""
+        workers = min(self.opts.workers, len(filenames))
+        if workers <= 1:
+            return [_read_header(filename) for filename in filenames]
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=context) as executor:
+            return list(executor.map(_read_header, filenames,
+                                     chunksize=max(1, len(filenames) // (workers * 8))))
+
     def _package_to_path(self, pkg):
         if len(self.base.repos):
             return os.path.join(self.opts.path, pkg.location)
@@ -41,14 +41,18 @@ class ShowLeaves(dnf.Plugin):
         if not leaves_command:
             return
         self.leaves_command = leaves_command(self.cli)
+        # kept to derive the post-transaction graph from the transaction delta
+        self.graph = self.leaves_command.buildgraph()
         self.pre_leaves = set(("%s.%s" % (x.name, x.arch)
-                               for x in self.leaves_command.findleaves()))
+                               for x in self.leaves_command.findleaves(self.graph)))
 
     def transaction(self):
         if not self.leaves_command:
             return
+        tx = self.base.transaction
+        graph = self.leaves_command.updategraph(self.graph, tx.install_set, tx.remove_set)
         self.post_leaves = set(("%s.%s" % (x.name, x.arch)
-                                for x in self.leaves_command.findleaves()))
+                                for x in self.leaves_command.findleaves(graph)))
         new_leaves = self.post_leaves - self.pre_leaves
         if new_leaves:
             print(_("New leaves:"))
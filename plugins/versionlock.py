@@ -19,14 +19,19 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from dnfpluginscore import _, logger
+from dnfpluginscore.files import atomic_write
 
 import dnf
 import dnf.cli
 import dnf.exceptions
+import errno
 import fnmatch
 import hawkey
+import marshal
 import os
-import tempfile
+import re
+import shutil
+import stat
 import time
 import warnings
 
@@ -43,6 +48,11 @@ NO_VERSIONLOCK = _('Excludes from versionlock plugin were not applied')
 APPLY_LOCK = _('Versionlock plugin: number of lock rules from file "{}" applied: {}')
 APPLY_EXCLUDE = _('Versionlock plugin: number of exclude rules from file "{}" applied: {}')
 NEVRA_ERROR = _('Versionlock plugin: could not parse pattern:')
+HOOK_TIME = _('Versionlock plugin: rules applied in {:.3f}s, {} packages excluded')
+
+# the parsed locklist is cached in this file next to the locklist
+RULES_CACHE_SUFFIX = '.cache'
+RULES_CACHE_VERSION = 1
 
 locklist_fn = None
 
@@ -78,34 +88,22 @@ class VersionLock(dnf.Plugin):
             logger.debug(NO_VERSIONLOCK)
             return
 
+        start = time.time()
+        rules = _read_rules()
+        (locked_pkgs, excluded_pkgs, locked_names) = _match_rules(self.base.sack, rules)
         excludes_query = self.base.sack.query().filter(empty=True)
         locked_query = self.base.sack.query().filter(empty=True)
-        locked_names = set()
+        if excluded_pkgs:
+            excludes_query = self.base.sack.query().filterm(pkg=excluded_pkgs)
+        if locked_pkgs:
+            locked_query = self.base.sack.query().filterm(pkg=locked_pkgs)
         # counter of applied rules [locked_count, excluded_count]
         count = [0, 0]
-        for pat in _read_locklist():
-            excl = 0
-            if pat and pat[0] == '!':
-                pat = pat[1:]
-                excl = 1
-
-            possible_nevras = dnf.subject.Subject(pat).get_nevra_possibilities(
-                forms=[hawkey.FORM_NEVRA, hawkey.FORM_NEVR, hawkey.FORM_NEV,
-                       hawkey.FORM_NA, hawkey.FORM_NAME])
-            if possible_nevras:
+        for excl, pat, possibilities in rules:
+            if possibilities:
                 count[excl] += 1
             else:
                 logger.error("%s %s", NEVRA_ERROR, pat)
-                continue
-            for nevra in possible_nevras:
-                pat_query = nevra.to_query(self.base.sack)
-                if excl:
-                    excludes_query = excludes_query.union(pat_query)
-                else:
-                    locked_names.add(nevra.name)
-                    locked_query = locked_query.union(pat_query)
-                if pat_query:
-                    break
 
         if count[1]:
             logger.debug(APPLY_EXCLUDE.format(locklist_fn, count[1]))
@@ -113,18 +111,24 @@ class VersionLock(dnf.Plugin):
             logger.debug(APPLY_LOCK.format(locklist_fn, count[0]))
 
         if locked_names:
-            all_versions = self.base.sack.query().filter(name__glob=list(locked_names))
-            other_versions = all_versions.difference(locked_query)
-            excludes_query = excludes_query.union(other_versions)
-            # exclude also anything that obsoletes the locked versions of packages
-            obsoletes_query = self.base.sack.query().filterm(obsoletes=locked_query)
-            # leave out obsoleters that are also part of locked versions (otherwise the obsoleter package
-            # would not be installable at all)
-            excludes_query = excludes_query.union(obsoletes_query.difference(locked_query))
+            # only packages from the enabled repos are ever excluded, so the
+            # queries below can leave out the installed packages
+            repo_pkgs = self.base.sack.query().filterm(reponame__neq=hawkey.SYSTEM_REPO_NAME)
+            all_versions = repo_pkgs.filter(name__glob=list(locked_names))
+            if all_versions:
+                other_versions = all_versions.difference(locked_query)
+                excludes_query = excludes_query.union(other_versions)
+            if locked_query:
+                # exclude also anything that obsoletes the locked versions of packages
+                obsoletes_query = repo_pkgs.filter(obsoletes=locked_query)
+                # leave out obsoleters that are also part of locked versions (otherwise the obsoleter
+                # package would not be installable at all)
+                excludes_query = excludes_query.union(obsoletes_query.difference(locked_query))
 
         excludes_query.filterm(reponame__neq=hawkey.SYSTEM_REPO_NAME)
         if excludes_query:
             self.base.sack.add_excludes(excludes_query)
+        logger.debug(HOOK_TIME.format(time.time() - start, len(excludes_query)))
 
 EXC_CMDS = ['exclude', 'add-!', 'add!']
 DEL_CMDS = ['delete', 'del']
@@ -172,26 +176,32 @@ class VersionLockCommand(dnf.cli.Command):
 
         if cmd == 'add':
             results = _search_locklist(self.opts.package)
+            new_entries = []
             for entry, entry_cmd in results:
                 if entry_cmd == '':
-                    _write_locklist(self.base, [entry], self.opts.raw, True,
-                                    "\n# Added lock on %s\n" % time.ctime(),
-                                    ADDING_SPEC, '')
+                    new_entries.append(entry)
                 elif cmd != entry_cmd:
                     raise dnf.exceptions.Error(ALREADY_EXCLUDED.format(entry))
                 else:
                     logger.info("%s %s", EXISTING_SPEC, entry)
+            if new_entries:
+                _write_locklist(self.base, new_entries, self.opts.raw, True,
+                                "\n# Added lock on %s\n" % time.ctime(),
+                                ADDING_SPEC, '')
         elif cmd == 'exclude':
             results = _search_locklist(self.opts.package)
+            new_entries = []
             for entry, entry_cmd in results:
                 if entry_cmd == '':
-                    _write_locklist(self.base, [entry], self.opts.raw, False,
-                                    "\n# Added exclude on %s\n" % time.ctime(),
-                                    EXCLUDING_SPEC, '!')
+                    new_entries.append(entry)
                 elif cmd != entry_cmd:
                     raise dnf.exceptions.Error(ALREADY_LOCKED.format(entry))
                 else:
                     logger.info("%s %s", EXISTING_SPEC, entry)
+            if new_entries:
+                _write_locklist(self.base, new_entries, self.opts.raw, False,
+                                "\n# Added exclude on %s\n" % time.ctime(),
+                                EXCLUDING_SPEC, '!')
         elif cmd == 'list':
             for pat in _read_locklist():
                 print(pat)
@@ -204,23 +214,17 @@ class VersionLockCommand(dnf.cli.Command):
         elif cmd == 'delete':
             if not locklist_fn:
                 raise dnf.exceptions.Error(NO_LOCKLIST)
-            dirname = os.path.dirname(locklist_fn)
-            (out, tmpfilename) = tempfile.mkstemp(dir=dirname, suffix='.tmp')
             locked_specs = _read_locklist()
-            count = 0
-            with os.fdopen(out, 'w', -1) as out:
-                for ent in locked_specs:
-                    if _match(ent, self.opts.package):
+            matching = LocklistIndex(locked_specs).search(self.opts.package)
+            if not matching:
+                return
+            with atomic_write(locklist_fn) as out:
+                for i, ent in enumerate(locked_specs):
+                    if i in matching:
                         print("%s %s" % (DELETING_SPEC, ent))
-                        count += 1
                         continue
                     out.write(ent)
                     out.write('\n')
-            if not count:
-                os.unlink(tmpfilename)
-            else:
-                os.chmod(tmpfilename, 0o644)
-                os.rename(tmpfilename, locklist_fn)
 
 
 def _read_locklist():
@@ -238,26 +242,139 @@ def _read_locklist():
     return locklist
 
 
+def _is_glob(pattern):
+    return any(c in pattern for c in '*?[')
+
+
+def _parse_rules(patterns):
+    """
+    Parse locklist patterns into rules, which are (exclude, pattern,
+    possibilities) tuples. possibilities are the (name, epoch, version,
+    release, arch) tuples the pattern may stand for in order of preference,
+    where None matches any value. They are empty if the pattern can't be
+    parsed.
+    """
+    rules = []
+    for pat in patterns:
+        excl = 0
+        if pat and pat[0] == '!':
+            pat = pat[1:]
+            excl = 1
+
+        possibilities = []
+        for nevra in dnf.subject.Subject(pat).get_nevra_possibilities(
+                forms=[hawkey.FORM_NEVRA, hawkey.FORM_NEVR, hawkey.FORM_NEV,
+                       hawkey.FORM_NA, hawkey.FORM_NAME]):
+            # "*" as the arch of specs written by versionlock add is any arch
+            arch = None if nevra.arch == '*' else nevra.arch
+            possibilities.append((nevra.name, nevra.epoch, nevra.version, nevra.release, arch))
+        rules.append((excl, pat, possibilities))
+    return rules
+
+
+def _read_rules():
+    """
+    Return _parse_rules() of the locklist. The rules are cached in a sidecar
+    file next to the locklist and reused as long as the mtime and size of
+    the locklist don't change.
+    """
+    if not locklist_fn:
+        raise dnf.exceptions.Error(NO_LOCKLIST)
+    try:
+        st = os.stat(locklist_fn)
+    except OSError as e:
+        raise dnf.exceptions.Error(NOT_READABLE % e)
+    key = [RULES_CACHE_VERSION, st.st_mtime_ns, st.st_size]
+    cache_fn = locklist_fn + RULES_CACHE_SUFFIX
+    try:
+        with open(cache_fn, 'rb') as f:
+            (cached_key, rules) = marshal.load(f)
+        if cached_key == key:
+            return rules
+    except (EnvironmentError, EOFError, ValueError, TypeError) as e:
+        logger.debug("Couldn't read versionlock cache %s: %s", cache_fn, e)
+
+    rules = _parse_rules(_read_locklist())
+    try:
+        with atomic_write(cache_fn, 'wb') as out:
+            marshal.dump((key, rules), out)
+    except (EnvironmentError, ValueError) as e:
+        logger.debug("Couldn't write versionlock cache %s: %s", cache_fn, e)
+    return rules
+
+
+def _nevra_matches(pkg, possibility):
+    for value, pattern in zip((pkg.epoch, pkg.version, pkg.release, pkg.arch), possibility[1:]):
+        if pattern is None or value == pattern:
+            continue
+        if not isinstance(pattern, int) and _is_glob(pattern) and fnmatch.fnmatchcase(value, pattern):
+            continue
+        return False
+    return True
+
+
+def _match_rules(sack, rules):
+    """
+    Return (locked packages, excluded packages, locked names) of the rules.
+
+    Like with queries of the single possibilities of each rule, the first
+    possibility matching any package is used. All rules are matched in one
+    pass over the packages with the names they refer to.
+    """
+    by_name = {}
+    name_globs = []
+    for i, (_excl, _pat, possibilities) in enumerate(rules):
+        for j, possibility in enumerate(possibilities):
+            if _is_glob(possibility[0]):
+                name_globs.append((i, j, possibility))
+            else:
+                by_name.setdefault(possibility[0], []).append((i, j, possibility))
+
+    matches = {}
+    query = sack.query()
+    if by_name:
+        for pkg in query.filter(name=list(by_name)):
+            for i, j, possibility in by_name[pkg.name]:
+                if _nevra_matches(pkg, possibility):
+                    matches.setdefault((i, j), []).append(pkg)
+    if name_globs:
+        for pkg in query.filter(name__glob=list(set(p[0] for _i, _j, p in name_globs))):
+            for i, j, possibility in name_globs:
+                if fnmatch.fnmatchcase(pkg.name, possibility[0]) and \
+                        _nevra_matches(pkg, possibility):
+                    matches.setdefault((i, j), []).append(pkg)
+
+    locked = []
+    excluded = []
+    locked_names = set()
+    for i, (excl, _pat, possibilities) in enumerate(rules):
+        for j, possibility in enumerate(possibilities):
+            if not excl:
+                locked_names.add(possibility[0])
+            pkgs = matches.get((i, j))
+            if pkgs:
+                (excluded if excl else locked).extend(pkgs)
+                break
+    return locked, excluded, locked_names
+
+
 def _search_locklist(package):
     results = []
-    found = action = ''
     locked_specs = _read_locklist()
+    index = LocklistIndex(locked_specs)
     for pkg in package:
-        match = False
-        for ent in locked_specs:
-            found = action = ''
-            if _match(ent, [pkg]):
-                found = ent
-                action = 'exclude' if ent.startswith('!') else 'add'
-                results.append((found, action))
-                match = True
-        if not match:
-            results.append((pkg, action))
+        matching = index.search([pkg])
+        for i in sorted(matching):
+            ent = locked_specs[i]
+            results.append((ent, 'exclude' if ent.startswith('!') else 'add'))
+        if not matching:
+            results.append((pkg, ''))
     return results
 
 
 def _write_locklist(base, args, raw, try_installed, comment, info, prefix):
     specs = set()
+    rpmdb_sack = None
     for pat in args:
         if raw:
             specs.add(pat)
@@ -265,7 +382,9 @@ def _write_locklist(base, args, raw, try_installed, comment, info, prefix):
         subj = dnf.subject.Subject(pat)
         pkgs = None
         if try_installed:
-            pkgs = subj.get_best_query(dnf.sack._rpmdb_sack(base), with_nevra=True,
+            if rpmdb_sack is None:
+                rpmdb_sack = dnf.sack._rpmdb_sack(base)
+            pkgs = subj.get_best_query(rpmdb_sack, with_nevra=True,
                                        with_provides=False, with_filenames=False)
         if not pkgs:
             pkgs = subj.get_best_query(base.sack, with_nevra=True, with_provides=False,
@@ -277,27 +396,40 @@ def _write_locklist(base, args, raw, try_installed, comment, info, prefix):
             specs.add(pkgtup2spec(*pkg.pkgtup))
 
     if specs:
+        if not locklist_fn:
+            raise dnf.exceptions.Error(NO_LOCKLIST)
+        # all new entries are written at once by replacing the locklist
+        # with a copy extended by them
         try:
-            if not locklist_fn:
-                raise dnf.exceptions.Error(NO_LOCKLIST)
-            with open(locklist_fn, 'a') as f:
-                f.write(comment)
-                for spec in specs:
+            try:
+                mode = stat.S_IMODE(os.stat(locklist_fn).st_mode)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                mode = 0o644
+            with atomic_write(locklist_fn, perms=mode) as out:
+                try:
+                    with open(locklist_fn) as f:
+                        shutil.copyfileobj(f, out)
+                except IOError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                out.write(comment)
+                for spec in sorted(specs):
                     print("%s %s" % (info, spec))
-                    f.write("%s%s\n" % (prefix, spec))
-        except IOError as e:
+                    out.write("%s%s\n" % (prefix, spec))
+        except (IOError, OSError) as e:
             raise dnf.exceptions.Error(NOT_READABLE % e)
 
-def _match(ent, patterns):
-    ent = ent.lstrip('!')
-    for pat in patterns:
-        if ent == pat:
-            return True
+
+def _entry_forms(ent):
+    """Return the forms of the locklist entry that patterns are matched
+    against, or an empty list if it is not a NEVRA."""
     try:
-        n = hawkey.split_nevra(ent)
+        n = hawkey.split_nevra(ent.lstrip('!'))
     except hawkey.ValueException:
-        return False
-    for name in (
+        return []
+    return [
         '%s' % n.name,
         '%s.%s' % (n.name, n.arch),
         '%s-%s' % (n.name, n.version),
@@ -307,11 +439,39 @@ def _match(ent, patterns):
         '%s-%s:%s-%s' % (n.name, n.epoch, n.version, n.release),
         '%s:%s-%s-%s.%s' % (n.epoch, n.name, n.version, n.release, n.arch),
         '%s-%s:%s-%s.%s' % (n.name, n.epoch, n.version, n.release, n.arch),
-    ):
+    ]
+
+
+class LocklistIndex(object):
+    """
+    Locklist entries indexed by the entry itself and all its forms, so
+    patterns without wildcards are looked up directly. Only glob patterns
+    are matched against the forms of every entry.
+    """
+
+    def __init__(self, entries):
+        self.forms = []
+        self.index = {}
+        for i, ent in enumerate(entries):
+            forms = _entry_forms(ent)
+            self.forms.append(forms)
+            self.index.setdefault(ent.lstrip('!'), set()).add(i)
+            for form in forms:
+                self.index.setdefault(form, set()).add(i)
+
+    def search(self, patterns):
+        """Return the set of indices of the entries matching any of the
+        patterns."""
+        found = set()
         for pat in patterns:
-            if fnmatch.fnmatch(name, pat):
-                return True
-    return False
+            found.update(self.index.get(pat, ()))
+            if not _is_glob(pat):
+                continue
+            match = re.compile(fnmatch.translate(pat)).match
+            for i, forms in enumerate(self.forms):
+                if i not in found and any(match(form) for form in forms):
+                    found.add(i)
+        return found
 
 
 def pkgtup2spec(name, arch, epoch, version, release):
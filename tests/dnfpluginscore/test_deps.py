@@ -0,0 +1,74 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from tests.support import mock
+
+import dnfpluginscore.deps
+import unittest
+
+
+class PkgStub(object):
+    def __init__(self, name, provides):
+        self.name = name
+        self.provides = provides
+
+
+class DepsTest(unittest.TestCase):
+    def test_split_reldep(self):
+        func = dnfpluginscore.deps.split_reldep
+        self.assertEqual(func('libfoo.so.1()(64bit)'), ('libfoo.so.1()(64bit)', None, None))
+        self.assertEqual(func('foo >= 1:2.0-3'), ('foo', '>=', '1:2.0-3'))
+        self.assertEqual(func('font(dejavu sans)'), ('font(dejavu sans)', None, None))
+        self.assertEqual(func('font(dejavu sans) = 2.3'), ('font(dejavu sans)', '=', '2.3'))
+
+    def test_providers(self):
+        foo = PkgStub('foo', ['foo', 'foo = 1-1', 'libfoo.so.1()(64bit)'])
+        bar = PkgStub('bar', ['bar = 2-1', 'libfoo.so.1()(64bit)'])
+        query = mock.MagicMock()
+        query.__iter__.return_value = [foo, bar]
+        query.filter.return_value.run.return_value = [foo]
+        index = dnfpluginscore.deps.ProvidesIndex(query)
+
+        self.assertEqual(index.providers('foo'), [foo])
+        self.assertEqual(index.providers('libfoo.so.1()(64bit)'), [foo, bar])
+        self.assertEqual(index.providers('baz'), [])
+        self.assertEqual(index.providers('baz >= 1'), [])
+        query.filter.assert_not_called()
+
+        self.assertEqual(index.providers('foo >= 1'), [foo])
+        query.filter.assert_called_once_with(provides='foo >= 1')
+
+    def test_arches(self):
+        query = mock.MagicMock()
+        index = dnfpluginscore.deps.ProvidesIndex(query, ['x86_64', 'i686'])
+        query.filter.assert_called_once_with(arch=['x86_64', 'i686', 'noarch'])
+        query.filter.return_value.union.assert_called_once_with(query.installed.return_value)
+        self.assertIs(index.query, query.filter.return_value.union.return_value)
+
+    def test_candidates(self):
+        foo = PkgStub('foo', ['foo = 1-1', 'libfoo.so.1()(64bit)'])
+        query = mock.MagicMock()
+        query.__iter__.return_value = [foo]
+        index = dnfpluginscore.deps.ProvidesIndex(query)
+
+        self.assertEqual(index.candidates('foo >= 2'), [(foo, 'foo = 1-1')])
+        self.assertEqual(index.candidates('bar >= 2'), [])
+        self.assertEqual(index.candidates('/usr/bin/foo'), [])
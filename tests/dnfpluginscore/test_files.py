@@ -0,0 +1,83 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import dnfpluginscore.files
+import json
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+
+class Cache(dnfpluginscore.files.JsonCache):
+    def __init__(self, path, version):
+        self.version = version
+        super(Cache, self).__init__(path)
+
+    def _header(self):
+        return {'version': self.version}
+
+
+class FilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='dnf_test_files_')
+        self.path = os.path.join(self.tmpdir, 'sub', 'file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_atomic_write(self):
+        with dnfpluginscore.files.atomic_write(self.path, perms=0o600) as out:
+            out.write('data')
+            self.assertFalse(os.path.exists(self.path))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'data')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['file'])
+
+    def test_atomic_write_failure(self):
+        dnfpluginscore.files.write_json(self.path, [1])
+        with self.assertRaises(ValueError):
+            with dnfpluginscore.files.atomic_write(self.path) as out:
+                out.write('partial')
+                raise ValueError
+        # the original file is kept and the temporary one removed
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), [1])
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['file'])
+
+    def test_json_cache(self):
+        cache = Cache(self.path, 1)
+        self.assertEqual(cache.entries, {})
+        cache.seen['a'] = [1]
+        cache.save()
+        self.assertEqual(Cache(self.path, 1).entries, {'a': [1]})
+        # a header mismatch discards the entries
+        self.assertEqual(Cache(self.path, 2).entries, {})
+
+    def test_json_cache_invalid(self):
+        for data in ([], {'version': 1}, {'version': 1, 'entries': []}):
+            dnfpluginscore.files.write_json(self.path, data)
+            self.assertEqual(Cache(self.path, 1).entries, {})
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual(Cache(self.path, 1).entries, {})
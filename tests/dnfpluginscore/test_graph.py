@@ -0,0 +1,67 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import dnfpluginscore.graph
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class GraphTest(unittest.TestCase):
+    def setUp(self):
+        # 0 <-> 1 -> 2, 3 -> 2, 4
+        self.graph = dnfpluginscore.graph.CSRGraph.from_lists(
+            [[1], [0, 2], [], [2], []])
+
+    def test_csr(self):
+        self.assertEqual(len(self.graph), 5)
+        self.assertEqual(list(self.graph.offsets), [0, 1, 3, 3, 4, 4])
+        self.assertEqual(list(self.graph[1]), [0, 2])
+        rgraph = self.graph.reverse()
+        self.assertEqual([list(rgraph[i]) for i in range(5)],
+                         [[1], [0], [1, 3], [], []])
+
+    def test_kosaraju(self):
+        leaves = dnfpluginscore.graph.kosaraju(self.graph, self.graph.reverse())
+        self.assertEqual(sorted(sorted(scc) for scc in leaves), [[0, 1], [3], [4]])
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'graph')
+        nodes = ['a', 'b', 'c', 'd', 'e']
+        dnfpluginscore.graph.save_graph(path, 'cookie', nodes, self.graph)
+
+        (loaded_nodes, graph) = dnfpluginscore.graph.load_graph(path, 'cookie')
+        self.assertEqual(loaded_nodes, nodes)
+        self.assertEqual(list(graph.offsets), list(self.graph.offsets))
+        self.assertEqual(list(graph.targets), list(self.graph.targets))
+        # the rpmdb changed
+        self.assertIsNone(dnfpluginscore.graph.load_graph(path, 'other'))
+        self.assertIsNone(dnfpluginscore.graph.load_graph(path + '.missing', 'cookie'))
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        for size in (len(data) - 1, data.index(b'\n') + 1, 10, 0):
+            with open(path, 'wb') as f:
+                f.write(data[:size])
+            self.assertIsNone(dnfpluginscore.graph.load_graph(path, 'cookie'))
@@ -0,0 +1,132 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from tests.support import mock
+
+import leaves
+import shutil
+import tempfile
+import tests.support as support
+
+
+class PkgStub(object):
+    def __init__(self, name, provides=(), requires=(), files=(), installed=True):
+        self.name = name
+        self.provides = [name] + list(provides)
+        self.requires = list(requires)
+        self.files = list(files)
+        self.installed = installed
+
+    def __str__(self):
+        return self.name
+
+    def provides_req(self, req):
+        if req.startswith('('):
+            return any(self.provides_req(r) for r in req[1:-1].split(' or '))
+        return req in self.provides or req in self.files
+
+
+class QueryStub(object):
+    def __init__(self, pkgs):
+        self.pkgs = list(pkgs)
+
+    def __iter__(self):
+        return iter(self.pkgs)
+
+    def apply(self):
+        return self
+
+    def run(self):
+        return list(self.pkgs)
+
+    def installed(self):
+        return QueryStub(pkg for pkg in self.pkgs if pkg.installed)
+
+    def filter(self, provides):
+        return QueryStub(pkg for pkg in self.pkgs if pkg.provides_req(str(provides)))
+
+    def filterm(self, pkg):
+        self.pkgs = [p for p in self.pkgs if p in pkg]
+        return self
+
+    def difference(self, other):
+        return QueryStub(pkg for pkg in self.pkgs if pkg not in other.pkgs)
+
+    def union(self, other):
+        return QueryStub(self.pkgs + [pkg for pkg in other.pkgs if pkg not in self.pkgs])
+
+
+class SackStub(object):
+    def __init__(self, pkgs):
+        self.pkgs = pkgs
+
+    def query(self):
+        return QueryStub(self.pkgs)
+
+
+class LeavesTest(support.TestCase):
+
+    def setUp(self):
+        self.cmd = leaves.LeavesCommand(support.CliStub(support.BaseStub()))
+        self.cmd.base.conf.cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cmd.base.conf.cachedir)
+        self.cmd.base._ts = mock.Mock()
+
+    def _buildgraph(self, pkgs, cookie):
+        self.cmd.base._ts.dbCookie.return_value = cookie
+        with mock.patch('dnf.sack._rpmdb_sack', return_value=SackStub(pkgs)):
+            return self.cmd.buildgraph()
+
+    @staticmethod
+    def _edges(graph):
+        (packages, depends, rdepends) = graph
+        return (dict((str(pkg), sorted(str(packages[j]) for j in depends[i]))
+                     for i, pkg in enumerate(packages)),
+                dict((str(pkg), sorted(str(packages[j]) for j in rdepends[i]))
+                     for i, pkg in enumerate(packages)))
+
+    def test_updategraph(self):
+        lib = PkgStub('lib', provides=['libfoo.so.1'], files=['/usr/bin/tool'])
+        app = PkgStub('app', requires=['libfoo.so.1'])
+        script = PkgStub('script', requires=['/usr/bin/tool'])
+        plugin = PkgStub('plugin', requires=['(gtk or qt)'])
+        gtk = PkgStub('gtk')
+        other = PkgStub('other', requires=['gtk'])
+        installed = [lib, app, script, plugin, gtk, other]
+        # lib is replaced by a split package, qt gives plugin a second choice
+        lib2 = PkgStub('lib2', provides=['libfoo.so.1'], installed=False)
+        tool = PkgStub('tool', files=['/usr/bin/tool'], installed=False)
+        qt = PkgStub('qt', installed=False)
+        install_set = [lib2, tool, qt]
+        remove_set = [lib]
+
+        graph = self._buildgraph(installed, 'before')
+        self.assertEqual(self._edges(graph)[0], {
+            'lib': [], 'app': ['lib'], 'script': ['lib'], 'plugin': ['gtk'], 'gtk': [],
+            'other': ['gtk']})
+
+        self.cmd.base.sack = SackStub(installed + install_set)
+        updated = self.cmd.updategraph(graph, install_set, remove_set)
+        after = [pkg for pkg in installed if pkg not in remove_set] + install_set
+        fresh = self._buildgraph(after, 'after')
+        self.assertEqual([str(pkg) for pkg in updated[0]], [str(pkg) for pkg in fresh[0]])
+        self.assertEqual(self._edges(updated), self._edges(fresh))
+        self.assertEqual(self._edges(updated)[0], {
+            'app': ['lib2'], 'script': ['tool'], 'plugin': [], 'gtk': [], 'other': ['gtk'],
+            'lib2': [], 'tool': [], 'qt': []})
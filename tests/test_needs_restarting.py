@@ -23,6 +23,8 @@ from __future__ import unicode_literals
 from unittest.mock import patch, Mock
 import dbus
 import needs_restarting
+import os
+import rpm
 import tests.support
 import tempfile
 
@@ -68,9 +70,126 @@ class NeedsRestartingTest(tests.support.TestCase):
             ofiles = list(needs_restarting.list_opened_files(None));
             self.assertEqual(ofiles[0].presumed_name, '/usr/lib64/lib�Evil-13.37.so')
 
+    def test_process_report(self):
+        func = needs_restarting.NeedsRestartingCommand._process_report
+        files = {'/usr/lib64/libfoo.so.1': 'foo-1-2.x86_64',
+                 '/usr/bin/bar': 'bar-3-4.x86_64'}
+        with patch("needs_restarting.get_cmdline", return_value='/usr/bin/bar --baz '):
+            report = func(1234, 'bar.service', 12.5, files)
+        self.assertEqual(report, {
+            'pid': 1234,
+            'start_time': 12.5,
+            'cmdline': '/usr/bin/bar --baz ',
+            'unit': 'bar.service',
+            'files': [{'file': '/usr/bin/bar', 'package': 'bar-3-4.x86_64'},
+                      {'file': '/usr/lib64/libfoo.so.1', 'package': 'foo-1-2.x86_64'}]})
+
+    def test_json_without_dbus(self):
+        cmd = needs_restarting.NeedsRestartingCommand(
+            tests.support.CliStub(tests.support.BaseStub()))
+        cmd.opts = Mock(reboothint=False, incremental=False, useronly=False, services=False,
+                        exclude_services=False, json=True, prometheus=None)
+        stale_files = {1234: (12.5, {'/usr/bin/bar': 'bar-3-4.x86_64'})}
+        with patch("needs_restarting.ProcessStart", return_value=Mock(boot_time=10)), \
+                patch("needs_restarting.get_options_from_dir", return_value=[]), \
+                patch("needs_restarting.updated_since", return_value=set()), \
+                patch("needs_restarting.get_cmdline", return_value='/usr/bin/bar'), \
+                patch.object(cmd, "_stale_files", return_value=stale_files), \
+                patch("needs_restarting.get_service_dbus",
+                      side_effect=dbus.DBusException("org.freedesktop.DBus.Error.NoServer")), \
+                patch("needs_restarting.print_json") as print_json:
+            cmd.run()
+        report = print_json.call_args[0][0]
+        self.assertEqual([(p['pid'], p['unit']) for p in report['processes']], [(1234, None)])
+        self.assertEqual(report['services'], [])
+
+        cmd.opts.services = True
+        with patch("needs_restarting.ProcessStart", return_value=Mock(boot_time=10)), \
+                patch("needs_restarting.get_options_from_dir", return_value=[]), \
+                patch.object(cmd, "_stale_files", return_value=stale_files), \
+                patch("needs_restarting.get_service_dbus",
+                      side_effect=dbus.DBusException("org.freedesktop.DBus.Error.NoServer")):
+            self.assertRaises(dbus.DBusException, cmd.run)
+
+    def test_installed_package_names_without_sack(self):
+        base = Mock(sack=None)
+        ts = Mock()
+        ts.dbMatch.side_effect = lambda tag, name: Mock(count=Mock(return_value=int(name == 'dbus')))
+        with patch("dnf.rpm.transaction.initReadOnlyTransaction", return_value=ts) as init:
+            names = needs_restarting.installed_package_names(base, ['dbus', 'kernel'])
+        self.assertEqual(names, {'dbus'})
+        init.assert_called_once_with(root=base.conf.installroot)
+
+    def test_updated_since(self):
+        base = Mock()
+        ts = Mock()
+        headers = {
+            'kernel': [{rpm.RPMTAG_NAME: b'kernel-core', rpm.RPMTAG_INSTALLTIME: 200},
+                       {rpm.RPMTAG_NAME: b'kernel', rpm.RPMTAG_INSTALLTIME: 50}],
+            'glibc': [{rpm.RPMTAG_NAME: b'glibc', rpm.RPMTAG_INSTALLTIME: 100}],
+        }
+        ts.dbMatch.side_effect = lambda tag, provide: headers.get(provide, [])
+        with patch("dnf.rpm.transaction.initReadOnlyTransaction", return_value=ts):
+            names = needs_restarting.updated_since(base, ['kernel', 'glibc', 'glibc', 'dbus'], 100)
+        self.assertEqual(names, {'kernel-core'})
+        self.assertEqual(sorted(call[0][1] for call in ts.dbMatch.call_args_list),
+                         ['dbus', 'glibc', 'kernel'])
+
+    def test_reboothint_skips_sack(self):
+        cmd = needs_restarting.NeedsRestartingCommand(
+            tests.support.CliStub(tests.support.BaseStub()))
+        tests.support.command_configure(cmd, ['-r'])
+        self.assertFalse(getattr(cmd.cli.demands, 'sack_activation', False))
+        tests.support.command_configure(cmd, [])
+        self.assertTrue(cmd.cli.demands.sack_activation)
+
 
 class OpenedFileTest(tests.support.TestCase):
     def test_presumed_name(self):
         ofile = needs_restarting.OpenedFile(
             100, '/usr/lib64/libgtk-3.so.0.1000.9;54085c6e', True)
         self.assertEqual(ofile.presumed_name, '/usr/lib64/libgtk-3.so.0.1000.9')
+
+
+class ProcessCacheTest(tests.support.TestCase):
+    def test_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, needs_restarting.CACHE_FILE)
+            cache = needs_restarting.ProcessCache(path, 'cookie1')
+            self.assertIsNone(cache.get(100, 12.5))
+            cache.set(100, 12.5, {'/usr/lib64/libfoo.so.1': 'foo-1-1.x86_64'})
+            cache.set(200, 13.0, {})
+            cache.save()
+
+            cache = needs_restarting.ProcessCache(path, 'cookie1')
+            self.assertEqual(cache.get(100, 12.5),
+                             {'/usr/lib64/libfoo.so.1': 'foo-1-1.x86_64'})
+            self.assertEqual(cache.get(200, 13.0), {})
+            # recycled PID
+            self.assertIsNone(cache.get(100, 20.0))
+
+    def test_rpmdb_changed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, needs_restarting.CACHE_FILE)
+            cache = needs_restarting.ProcessCache(path, 'cookie1')
+            cache.set(100, 12.5, {})
+            cache.save()
+
+            cache = needs_restarting.ProcessCache(path, 'cookie2')
+            self.assertIsNone(cache.get(100, 12.5))
+
+
+class WriteMetricsTest(tests.support.TestCase):
+    def test_write_metrics(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'needs_restarting.prom')
+            needs_restarting.write_metrics(path, [('foo_total', 'Foo help.', 3),
+                                                  ('bar', 'Bar help.', True)])
+            with open(path) as f:
+                self.assertEqual(f.read(), '# HELP foo_total Foo help.\n'
+                                           '# TYPE foo_total gauge\n'
+                                           'foo_total 3\n'
+                                           '# HELP bar Bar help.\n'
+                                           '# TYPE bar gauge\n'
+                                           'bar 1\n')
+            self.assertEqual(os.listdir(tmpdir), ['needs_restarting.prom'])
@@ -21,8 +21,11 @@ from tests.support import mock
 
 import dnf.pycomp
 import dnf.repo
+import json
 import os
 import repoclosure
+import shutil
+import tempfile
 import tests.support as support
 
 
@@ -95,3 +98,131 @@ class TestRepoClosureFunctions(support.TestCase):
                             "  unresolved deps (1):",
                             "    bar = 4-6"]
             self.assertEqual(stdout.getvalue()[:-1], "\n".join(expected_out))
+
+    def test_json_format(self):
+        args = ["--format", "json"]
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/foo-4-6.noarch.rpm")])
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            with self.assertRaises(dnf.exceptions.Error):
+                support.command_run(self.cmd, args)
+            data = json.loads(stdout.getvalue())
+        self.assertEqual(data["packages"], 1)
+        self.assertEqual(data["unresolved_deps"], 1)
+        report = data["reports"][0]
+        self.assertIsNone(report["arch"])
+        self.assertCountEqual(report["timings"].keys(),
+                              ["sack_load", "requires_collection", "resolution"])
+        self.assertEqual(report["packages"], [{
+            "package": "foo-4-6.noarch",
+            "repo": "@commandline",
+            "unresolved": [{"dep": "bar = 4-6", "candidates": []}]}])
+
+    def test_per_arch_option_requires_arch(self):
+        args = ["--per-arch", "--arch", "noarch"]
+        with self.assertRaises(dnf.exceptions.Error) as context:
+            support.command_run(self.cmd, args)
+        self.assertEqual(context.exception.value, "--per-arch requires at least one --arch")
+
+    def test_per_arch_worker(self):
+        args = ["--per-arch", "--arch", "aarch64", "--arch", "noarch"]
+        self.cmd.base.repos.add(dnf.repo.Repo(name="main"))
+        self.cmd.base.repos.add(dnf.repo.Repo(name="other"))
+        self.cmd.base.repos["other"].disable()
+        substitutions = []
+
+        def read_all_repos(opts=None):
+            substitutions.append(dict(self.cmd.base.conf.substitutions))
+            self.cmd.base.repos.add(dnf.repo.Repo(name="main"))
+            self.cmd.base.repos.add(dnf.repo.Repo(name="other"))
+
+        def fill_sack(load_system_repo=False, load_available_repos=True):
+            self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/foo-4-6.noarch.rpm")])
+
+        support.command_configure(self.cmd, args)
+        # the parent does not load any metadata
+        self.assertFalse(self.cmd.cli.demands.sack_activation)
+        self.cmd.baseline = None
+        repoclosure._worker_command = self.cmd
+        with mock.patch.object(self.cmd.base, "read_all_repos", side_effect=read_all_repos,
+                               create=True), \
+                mock.patch.object(self.cmd.base, "fill_sack", side_effect=fill_sack):
+            (report, error) = repoclosure._closure_worker("aarch64")
+        self.assertIsNone(error)
+        # the repos were read again for the checked arch
+        self.assertEqual(len(substitutions), 1)
+        self.assertEqual(substitutions[0]["arch"], "aarch64")
+        self.assertEqual(substitutions[0]["basearch"], "aarch64")
+        self.assertEqual([repo.id for repo in self.cmd.base.repos.iter_enabled()], ["main"])
+        self.assertEqual(report[0], [("foo-4-6.noarch", "@commandline", [("bar = 4-6", [])])])
+
+
+class PkgStub(object):
+    def __init__(self, nevra, reponame, provides):
+        self.nevra = nevra
+        self.reponame = reponame
+        self.provides = provides
+
+    def __str__(self):
+        return self.nevra
+
+
+class TestBaseline(support.TestCase):
+
+    @staticmethod
+    def _provides(pkgs):
+        query = mock.MagicMock()
+        query.__iter__.side_effect = lambda: iter(pkgs)
+        query.filter.return_value.run.return_value = []
+        return repoclosure.ProvidesIndex(query)
+
+    def test_resolve(self):
+        foo = PkgStub("foo-1-1.noarch", "main", ["foo", "libfoo"])
+        bar = PkgStub("bar-1-1.noarch", "main", ["bar"])
+        baz = PkgStub("baz-1-1.noarch", "main", ["baz"])
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "baseline.json")
+
+        baseline = repoclosure.Baseline(path, {"main": "1"}, [])
+        self.assertIsNone(baseline.report)
+        resolved = baseline.resolve({"foo", "libfoo", "baz"}, self._provides([foo, bar]))
+        self.assertEqual(resolved, {"foo": True, "libfoo": True, "baz": False})
+        baseline.save([["baz-requirer-1-1.noarch", "main", ["baz"]]])
+
+        baseline = repoclosure.Baseline(path, {"main": "1"}, [])
+        self.assertEqual(baseline.report, [["baz-requirer-1-1.noarch", "main", ["baz"]]])
+
+        # foo was removed and baz added
+        baseline = repoclosure.Baseline(path, {"main": "2"}, [])
+        self.assertIsNone(baseline.report)
+        resolved = baseline.resolve({"foo", "libfoo", "bar", "baz"}, self._provides([bar, baz]))
+        self.assertEqual(resolved, {"foo": False, "libfoo": False, "bar": True, "baz": True})
+
+        # other options invalidate the baseline
+        baseline = repoclosure.Baseline(path, {"main": "1"}, [["x86_64"]])
+        self.assertIsNone(baseline.report)
+        self.assertEqual(baseline.deps, {})
+
+    def test_invalid(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "baseline.json")
+        for data in ([], {"version": repoclosure.Baseline.VERSION, "options": []},
+                     {"version": repoclosure.Baseline.VERSION, "options": [],
+                      "packages": {}, "deps": []}):
+            with open(path, "w") as f:
+                json.dump(data, f)
+            baseline = repoclosure.Baseline(path, {"main": "1"}, [])
+            self.assertEqual((baseline.packages, baseline.deps, baseline.report), ([], {}, None))
+
+    def test_available_packages_checksum(self):
+        cmd = repoclosure.RepoClosureCommand(support.CliStub(support.BaseStub()))
+        cmd.base.repos.add(dnf.repo.Repo(name="main"))
+        with mock.patch.object(dnf.repo.Repo, "get_metadata_path", return_value=None):
+            checksums = cmd._baseline_checksums()
+            # an exclude changes the available packages but not the metadata
+            with mock.patch.object(cmd.base.sack, "query") as query:
+                query.return_value.filter.return_value = []
+                query.return_value.available.return_value = [
+                    PkgStub("foo-1-1.noarch", "main", [])]
+                self.assertNotEqual(cmd._baseline_checksums(), checksums)
@@ -19,8 +19,11 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 from tests.support import mock
 
+import array
 import dnf.pycomp
 import dnf.repo
+import io
+import json
 import os
 import repograph
 import tests.support as support
@@ -61,3 +64,59 @@ class TestRepoGraphFunctions(support.TestCase):
                               '} [color="0.526086956522 0.626086956522 1.0"];\n',
                               "}\n"]
         self.assertEqual(stdout.getvalue(), "\n".join(expected_graph))
+
+    def test_csv_format(self):
+        args = ["--format", "csv"]
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/foo-4-6.noarch.rpm")])
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/bar-4-6.noarch.rpm")])
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        self.assertEqual(stdout.getvalue(), "source,target\nfoo,bar\n")
+
+    def test_graphml_format(self):
+        args = ["--format", "graphml"]
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/foo-4-6.noarch.rpm")])
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/bar-4-6.noarch.rpm")])
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        self.assertEqual(stdout.getvalue(), "\n".join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">',
+            '<graph id="packages" edgedefault="directed">',
+            '<node id="foo"/>',
+            '<node id="bar"/>',
+            '<edge source="foo" target="bar"/>',
+            '</graph>',
+            '</graphml>\n']))
+
+    def test_csr_format(self):
+        args = ["--format", "csr"]
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/foo-4-6.noarch.rpm")])
+        self.cmd.base.add_remote_rpms([os.path.join(self.path, "noarch/bar-4-6.noarch.rpm")])
+        with mock.patch("sys.stdout", new=io.TextIOWrapper(io.BytesIO())) as stdout:
+            support.command_run(self.cmd, args)
+            data = stdout.buffer.getvalue()
+        (header, arrays) = data.split(b"\n", 1)
+        header = json.loads(header.decode("utf-8"))
+        self.assertEqual(header["nodes"], ["foo", "bar"])
+        self.assertEqual(header["edges"], 1)
+        # offsets of len(nodes) + 1 items followed by the targets
+        offsets = array.array("i")
+        offsets.frombytes(arrays[:3 * header["itemsize"]])
+        targets = array.array("i")
+        targets.frombytes(arrays[3 * header["itemsize"]:])
+        self.assertEqual(list(offsets), [0, 1, 1])
+        self.assertEqual(list(targets), [1])
+
+    def test_depth_option(self):
+        args = ["--subgraph", "foo", "--depth", "0"]
+        with self.assertRaises(dnf.exceptions.Error) as context:
+            support.command_run(self.cmd, args)
+        self.assertEqual(context.exception.value, "--depth must be at least 1")
+
+    def test_subgraph(self):
+        deps = {"a": ["b", "c"], "b": ["c"], "c": ["d"], "d": []}
+        subgraph = repograph.RepoGraphCommand._subgraph
+        self.assertEqual(subgraph(deps, "a", 1), {"a": ["b", "c"]})
+        self.assertEqual(subgraph(deps, "a", 2), {"a": ["b", "c"], "b": ["c"], "c": ["d"]})
+        self.assertEqual(subgraph(deps, "d", 3), {"d": []})
@@ -20,17 +20,37 @@ from __future__ import unicode_literals
 from tests.support import mock
 
 import dnf.pycomp
+import gzip
+import json
 import os
 import repomanage
+import shutil
+import tempfile
 import tests.support as support
 
 
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary"><location href="repodata/primary.xml.gz"/></data>
+</repomd>
+"""
+
+PRIMARY_PACKAGE = """<package type="rpm">
+  <name>foo</name><arch>{}</arch><version epoch="0" ver="4" rel="{}"/>
+  <location href="{}"/>
+</package>
+"""
+
+
 class TestRepoManageFunctions(support.TestCase):
 
     def setUp(self):
         self.cmd = repomanage.RepoManageCommand(
             support.CliStub(support.BaseStub()))
         self.path = os.path.join(os.path.dirname(__file__), "resources/repomanage/")
+        self.cachedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cachedir)
+        self.cmd.base.conf.cachedir = self.cachedir
 
     @staticmethod
     def _path_join_in_list(l, path):
@@ -67,6 +87,40 @@ class TestRepoManageFunctions(support.TestCase):
             self.assertEqual(stdout.getvalue().split(),
                              self._path_join_in_list(expected_list, self.path))
 
+    def test_duplicate_nevra(self):
+        path = self._copy_resources()
+        os.mkdir(os.path.join(path, "copy"))
+        shutil.copy(os.path.join(path, "noarch/foo-4-8.noarch.rpm"), os.path.join(path, "copy"))
+        args = ["--old", path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        expected_list = ["foo-4-6.src.rpm",
+                         "foo-4-7.src.rpm",
+                         "noarch/foo-4-6.noarch.rpm",
+                         "noarch/foo-4-7.noarch.rpm"]
+        self.assertEqual(stdout.getvalue().split(), self._path_join_in_list(expected_list, path))
+
+        args = ["--new", "--keep", "2", path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        expected_list = ["copy/foo-4-8.noarch.rpm",
+                         "foo-4-7.src.rpm",
+                         "foo-4-8.src.rpm",
+                         "noarch/foo-4-7.noarch.rpm",
+                         "noarch/foo-4-8.noarch.rpm"]
+        self.assertEqual(stdout.getvalue().split(), self._path_join_in_list(expected_list, path))
+
+    def test_workers_option(self):
+        args = ["--old", "--workers", "2", self.path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+            expected_list = ["foo-4-6.src.rpm",
+                             "foo-4-7.src.rpm",
+                             "noarch/foo-4-6.noarch.rpm",
+                             "noarch/foo-4-7.noarch.rpm"]
+            self.assertEqual(stdout.getvalue().split(),
+                             self._path_join_in_list(expected_list, self.path))
+
     def test_space_option(self):
         args = ["--new", "--space", self.path]
         with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
@@ -75,3 +129,140 @@ class TestRepoManageFunctions(support.TestCase):
                              "noarch/foo-4-8.noarch.rpm"]
             self.assertEqual(stdout.getvalue()[:-1],
                              " ".join(self._path_join_in_list(expected_list, self.path)))
+
+    def test_header_cache(self):
+        args = ["--old", self.path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        with mock.patch("repomanage.read_nevra") as read_nevra, \
+                mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as cached_stdout:
+            support.command_run(self.cmd, args)
+        read_nevra.assert_not_called()
+        self.assertEqual(stdout.getvalue(), cached_stdout.getvalue())
+
+    def test_primary(self):
+        repo = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo)
+        os.mkdir(os.path.join(repo, "repodata"))
+        with open(os.path.join(repo, "repodata", "repomd.xml"), "w") as f:
+            f.write(REPOMD)
+        with gzip.open(os.path.join(repo, "repodata", "primary.xml.gz"), "wt") as f:
+            f.write('<metadata xmlns="http://linux.duke.edu/metadata/common" packages="4">')
+            for arch, release, location in [("noarch", "10", "noarch/foo-4-10.noarch.rpm"),
+                                            ("noarch", "9", "noarch/foo-4-9.noarch.rpm"),
+                                            ("src", "9", "foo-4-9.src.rpm"),
+                                            ("src", "10", "foo-4-10.src.rpm")]:
+                f.write(PRIMARY_PACKAGE.format(arch, release, location))
+            f.write("</metadata>")
+        args = ["--old", repo]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        self.assertFalse(self.cmd.cli.demands.sack_activation)
+        self.assertEqual(stdout.getvalue().split(),
+                         self._path_join_in_list(["foo-4-9.src.rpm", "noarch/foo-4-9.noarch.rpm"],
+                                                 repo))
+
+    def _copy_resources(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "repo/")
+        shutil.copytree(self.path, path)
+        return path
+
+    def test_delete_option(self):
+        path = self._copy_resources()
+        args = ["--old", "--delete", path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO):
+            support.command_run(self.cmd, args)
+        self.assertEqual(sorted(os.listdir(path)), ["foo-4-8.src.rpm", "foo.spec", "noarch"])
+        self.assertEqual(os.listdir(os.path.join(path, "noarch")), ["foo-4-8.noarch.rpm"])
+
+    def test_delete_duplicate_nevra(self):
+        path = self._copy_resources()
+        os.mkdir(os.path.join(path, "copy"))
+        shutil.copy(os.path.join(path, "noarch/foo-4-8.noarch.rpm"), os.path.join(path, "copy"))
+        args = ["--old", "--delete", path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO):
+            support.command_run(self.cmd, args)
+        # both files of the newest build survive
+        self.assertEqual(os.listdir(os.path.join(path, "noarch")), ["foo-4-8.noarch.rpm"])
+        self.assertEqual(os.listdir(os.path.join(path, "copy")), ["foo-4-8.noarch.rpm"])
+        self.assertEqual(sorted(os.listdir(path)),
+                         ["copy", "foo-4-8.src.rpm", "foo.spec", "noarch"])
+
+    def test_move_dry_run_json(self):
+        path = self._copy_resources()
+        target = os.path.join(path, "old")
+        args = ["--old", "--move", target, "--dry-run", "--json", path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            support.command_run(self.cmd, args)
+        summary = json.loads(stdout.getvalue())
+        expected_list = ["foo-4-6.src.rpm",
+                         "foo-4-7.src.rpm",
+                         "noarch/foo-4-6.noarch.rpm",
+                         "noarch/foo-4-7.noarch.rpm"]
+        self.assertEqual(summary["packages"], self._path_join_in_list(expected_list, path))
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["bytes"],
+                         sum(os.path.getsize(p) for p in summary["packages"]))
+        self.assertFalse(os.path.exists(target))
+
+    def test_action_requires_old(self):
+        path = self._copy_resources()
+        for args in (["--delete", path], ["--new", "--move", "old", path]):
+            with self.assertRaises(dnf.exceptions.Error) as context:
+                support.command_run(self.cmd, args)
+            self.assertEqual(context.exception.value,
+                             "--delete and --move require --old or --oldonly")
+        self.assertEqual(sorted(os.listdir(path)),
+                         sorted(os.listdir(self.path)))
+
+    def test_action_remote_path(self):
+        args = ["--old", "--delete", "https://example.com/repo/"]
+        with self.assertRaises(dnf.exceptions.Error) as context:
+            support.command_run(self.cmd, args)
+        self.assertEqual(context.exception.value, "--delete and --move require a local path")
+
+    def test_move_collision(self):
+        path = self._copy_resources()
+        target = os.path.join(path, "old")
+        os.mkdir(target)
+        with open(os.path.join(target, "foo-4-6.src.rpm"), "w") as f:
+            f.write("kept")
+        args = ["--old", "--move", target, "--json", path]
+        with mock.patch("sys.stdout", new_callable=dnf.pycomp.StringIO) as stdout:
+            with self.assertRaises(dnf.exceptions.Error):
+                support.command_run(self.cmd, args)
+        summary = json.loads(stdout.getvalue())
+        self.assertEqual(summary["count"], 3)
+        self.assertEqual([failed["path"] for failed in summary["failed"]],
+                         [os.path.join(path, "foo-4-6.src.rpm")])
+        with open(os.path.join(target, "foo-4-6.src.rpm")) as f:
+            self.assertEqual(f.read(), "kept")
+        self.assertTrue(os.path.exists(os.path.join(path, "foo-4-6.src.rpm")))
+        self.assertEqual(sorted(os.listdir(target)),
+                         ["foo-4-6.noarch.rpm", "foo-4-6.src.rpm", "foo-4-7.noarch.rpm",
+                          "foo-4-7.src.rpm"])
+
+    def test_vanished_directory(self):
+        path = self._copy_resources()
+        self.cmd.opts = mock.Mock(dry_run=False, move=None)
+        (count, size, failed) = self.cmd._apply_action(
+            "delete", [os.path.join(path, "gone/foo-4-6.noarch.rpm")])
+        self.assertEqual((count, size), (0, 0))
+        self.assertEqual(failed, [(os.path.join(path, "gone/foo-4-6.noarch.rpm"),
+                                   "No such file or directory")])
+
+    def test_select_stream_artifacts(self):
+        module = mock.Mock
+        module_dict = {"foo:1": {3: [module(getArtifacts=lambda: ["foo-3", "bar-1"])],
+                                 1: [module(getArtifacts=lambda: ["foo-1", "bar-1"])],
+                                 2: [module(getArtifacts=lambda: ["foo-2"])]}}
+        streams = repomanage.sorted_stream_versions(module_dict)
+        select = self.cmd._select_stream_artifacts
+        self.cmd.opts = mock.Mock(new=True, old=False, oldonly=False)
+        self.assertEqual(select(streams, 1), {"foo-3", "bar-1"})
+        self.cmd.opts = mock.Mock(new=False, old=True, oldonly=False)
+        self.assertEqual(select(streams, 1), {"foo-1", "foo-2", "bar-1"})
+        self.cmd.opts = mock.Mock(new=False, old=False, oldonly=True)
+        self.assertEqual(select(streams, 1), {"foo-1", "foo-2"})
@@ -0,0 +1,184 @@
+# Copyright (C) 2026  Red Hat, Inc.
+#
+# This copyrighted material is made available to anyone wishing to use,
+# modify, copy, or redistribute it subject to the terms and conditions of
+# the GNU General Public License v.2, or (at your option) any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY expressed or implied, including the implied warranties of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.  You should have received a copy of the
+# GNU General Public License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.  Any Red Hat trademarks that are incorporated in the
+# source code or documentation are not subject to the GNU General Public
+# License and may only be used or replicated with the express permission of
+# Red Hat, Inc.
+#
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+from tests.support import mock
+
+import dnf.subject
+import hawkey
+import marshal
+import os
+import shutil
+import tempfile
+import tests.support as support
+import versionlock
+
+FORMS = [hawkey.FORM_NEVRA, hawkey.FORM_NEVR, hawkey.FORM_NEV, hawkey.FORM_NA, hawkey.FORM_NAME]
+
+
+def query_rules(sack, patterns):
+    """Match the patterns the way the plugin did before _match_rules(),
+    with a query for each NEVRA possibility."""
+    locked = set()
+    excluded = set()
+    for pat in patterns:
+        excl = pat.startswith('!')
+        for nevra in dnf.subject.Subject(pat.lstrip('!')).get_nevra_possibilities(forms=FORMS):
+            pkgs = nevra.to_query(sack).run()
+            if pkgs:
+                (excluded if excl else locked).update(str(pkg) for pkg in pkgs)
+                break
+    return locked, excluded
+
+
+class VersionLockTest(support.TestCase):
+
+    def setUp(self):
+        self.base = support.BaseStub()
+        path = os.path.join(os.path.dirname(__file__), "resources/repomanage/")
+        self.base.add_remote_rpms([os.path.join(path, name) for name in (
+            "noarch/foo-4-6.noarch.rpm", "noarch/foo-4-7.noarch.rpm",
+            "noarch/foo-4-8.noarch.rpm", "foo-4-7.src.rpm")])
+        self.base.add_remote_rpms([os.path.join(os.path.dirname(__file__),
+                                                "resources/tour-4-6.src.rpm")])
+
+    def assertMatchesQueries(self, patterns):
+        (locked, excluded, _names) = versionlock._match_rules(
+            self.base.sack, versionlock._parse_rules(patterns))
+        self.assertEqual((set(str(pkg) for pkg in locked), set(str(pkg) for pkg in excluded)),
+                         query_rules(self.base.sack, patterns))
+
+    def test_match_rules(self):
+        for pat in ["foo-0:4-7.noarch", "foo-0:4-7.*", "foo-4-8", "foo-0:4", "foo.src",
+                    "foo", "tour", "bar", "foo-5-1.noarch"]:
+            self.assertMatchesQueries([pat])
+
+    def test_match_rules_globs(self):
+        for pat in ["f*", "fo?-4-7.noarch", "foo-4-[67]", "foo-4-*.noarch", "*.src",
+                    "t*-0:4-6.*", "b*"]:
+            self.assertMatchesQueries([pat])
+
+    def test_match_rules_exclude(self):
+        self.assertMatchesQueries(["!foo-0:4-8.*", "!tour", "foo-4-7"])
+        self.assertMatchesQueries(["!f*-4-6"])
+
+    def test_match_rules_all(self):
+        self.assertMatchesQueries(["foo-0:4-7.*", "!foo-4-8.noarch", "tour", "fo*.src", "bar"])
+
+    def test_locklist_index(self):
+        index = versionlock.LocklistIndex([
+            "foo-1:2.0-3.fc30.x86_64", "!bar-0:4-5.*", "not a nevra", "foo-1:2.0-4.fc30.noarch"])
+        # the entry itself and each of its forms
+        for pat in ["foo-1:2.0-3.fc30.x86_64", "foo", "foo.x86_64", "foo-2.0", "foo-2.0-3.fc30",
+                    "foo-1:2.0", "foo-2.0-3.fc30.x86_64", "foo-1:2.0-3.fc30",
+                    "1:foo-2.0-3.fc30.x86_64"]:
+            self.assertIn(0, index.search([pat]), pat)
+        self.assertEqual(index.search(["foo"]), {0, 3})
+        self.assertEqual(index.search(["foo-2.0-3.fc30"]), {0})
+        self.assertEqual(index.search(["foo-1:2.0-4.fc30.noarch"]), {3})
+        self.assertEqual(index.search(["foo-2.0-3"]), set())
+
+    def test_locklist_index_globs(self):
+        index = versionlock.LocklistIndex([
+            "foo-1:2.0-3.fc30.x86_64", "!bar-0:4-5.*", "not a nevra", "foo-1:2.0-4.fc30.noarch"])
+        self.assertEqual(index.search(["f*"]), {0, 3})
+        self.assertEqual(index.search(["*.x86_64"]), {0})
+        self.assertEqual(index.search(["foo-2.0-[3]*"]), {0})
+        self.assertEqual(index.search(["*"]), {0, 1, 3})
+        self.assertEqual(index.search(["nomatch*", "bar.*"]), {1})
+
+    def test_locklist_index_excludes(self):
+        index = versionlock.LocklistIndex(["!bar-0:4-5.*", "bar-0:4-6.*"])
+        # "!" entries are matched without the "!"
+        self.assertEqual(index.search(["bar-0:4-5.*"]), {0})
+        self.assertEqual(index.search(["bar-4-5"]), {0})
+        self.assertEqual(index.search(["bar"]), {0, 1})
+        self.assertEqual(index.search(["!bar"]), set())
+
+    def test_locklist_index_unparsable(self):
+        index = versionlock.LocklistIndex(["not a nevra", "foo"])
+        # entries split_nevra() rejects only match literally
+        self.assertEqual(index.search(["not a nevra"]), {0})
+        self.assertEqual(index.search(["foo"]), {1})
+        self.assertEqual(index.search(["not*", "f*"]), set())
+
+
+class ReadRulesTest(support.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.locklist = os.path.join(self.tmpdir, 'versionlock.list')
+        self.cache = self.locklist + versionlock.RULES_CACHE_SUFFIX
+        patcher = mock.patch('versionlock.locklist_fn', self.locklist)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._write(["foo-0:4-7.*", "!bar"])
+
+    def _write(self, entries, mtime_ns=10 ** 18):
+        with open(self.locklist, 'w') as f:
+            f.write("# comment\n")
+            for ent in entries:
+                f.write(ent + "\n")
+        os.utime(self.locklist, ns=(mtime_ns, mtime_ns))
+
+    def _read_rules(self):
+        with mock.patch('versionlock._parse_rules', wraps=versionlock._parse_rules) as parse:
+            rules = versionlock._read_rules()
+        return rules, parse.called
+
+    def test_cache_hit(self):
+        (rules, parsed) = self._read_rules()
+        self.assertTrue(parsed)
+        self.assertEqual([rule[:2] for rule in rules], [(0, "foo-0:4-7.*"), (1, "bar")])
+        self.assertTrue(os.path.exists(self.cache))
+        self.assertEqual(self._read_rules(), (rules, False))
+
+    def test_cache_invalidated(self):
+        self._read_rules()
+        # same size, other mtime
+        self._write(["foo-0:4-8.*", "!bar"], mtime_ns=2 * 10 ** 18)
+        (rules, parsed) = self._read_rules()
+        self.assertTrue(parsed)
+        self.assertEqual(rules[0][1], "foo-0:4-8.*")
+        # same mtime, other size
+        self._write(["foo-0:4-8.*", "!baz2"], mtime_ns=2 * 10 ** 18)
+        (rules, parsed) = self._read_rules()
+        self.assertTrue(parsed)
+        self.assertEqual(rules[1][1], "baz2")
+        self.assertEqual(self._read_rules(), (rules, False))
+
+    def test_cache_invalid(self):
+        (rules, _parsed) = self._read_rules()
+        for data in (b"garbage", b""):
+            with open(self.cache, 'wb') as f:
+                f.write(data)
+            self.assertEqual(self._read_rules(), (rules, True))
+        for foreign in (5, (1, 2, 3), {'a': 1, 'b': 2}, [[], []]):
+            with open(self.cache, 'wb') as f:
+                marshal.dump(foreign, f)
+            self.assertEqual(self._read_rules(), (rules, True))
+        # the cache was rewritten
+        self.assertEqual(self._read_rules(), (rules, False))
+
+    def test_cache_write_failure(self):
+        with mock.patch('versionlock.marshal.dump', side_effect=ValueError):
+            (rules, parsed) = self._read_rules()
+        self.assertTrue(parsed)
+        self.assertEqual(len(rules), 2)
+        self.assertEqual(os.listdir(self.tmpdir), ['versionlock.list'])